@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+
+# Admission control for expensive plans, and single-flight coalescing of identical plan
+# requests, both kept per process. Each plan request is costed from its size before any
+# work is done. Cheap plans run straight away. Heavy plans take one of a few slots, or
+# wait in a bounded queue for one; when the queue is full, or the wait runs out, a heavy
+# plan is downgraded to the fair playtime planner if nothing it asked for needs the
+# solver, and is shed otherwise.
+
+# Estimated planning milliseconds per segment and player in each scheduling mode (from
+# bench.py), and added by each constraint or substitution-rule search (measured from 8
+# players over 8 segments to 22 over 90)
+MODE_COST_MS = {'greedy': 0.004, 'sticky': 0.016, 'balanced': 0.011, 'diverse': 0.012}
+SEARCH_COST_MS = 0.015
+
+# Function to estimate a plan request's cost in milliseconds; it grows with the segments
+# and players of every plan, searches included
+def estimate_cost(segments, players, mode='greedy', searches=0, plans=1):
+    per_segment = MODE_COST_MS.get(mode, max(MODE_COST_MS.values())) + searches * SEARCH_COST_MS
+    return plans * segments * players * per_segment
+
+# Function to build a gate: `slots` heavy plans run at once, up to `queue_size` more wait
+# at most `timeout` seconds, and plans estimated under `heavy_ms` skip the gate
+def make_gate(slots, queue_size, timeout, heavy_ms):
+    return {'condition': threading.Condition(), 'slots': slots, 'queue_size': queue_size, 'timeout': timeout,
+            'heavy_ms': heavy_ms, 'running': 0, 'waiting': 0,
+            'counts': {'cheap': 0, 'admitted': 0, 'queued': 0, 'timed_out': 0, 'downgraded': 0, 'rejected': 0}}
+
+# Function to admit a plan of the given cost. Returns 'cheap' (no slot needed), 'run' (a
+# slot is held until release), 'downgrade' (plan with greedy, no slot) or 'reject'.
+def admit(gate, cost, downgradable):
+    condition, counts = gate['condition'], gate['counts']
+    with condition:
+        if cost < gate['heavy_ms']:
+            counts['cheap'] += 1
+            return 'cheap'
+        if gate['running'] >= gate['slots'] and gate['waiting'] < gate['queue_size']:
+            counts['queued'] += 1
+            gate['waiting'] += 1
+            try:
+                if not condition.wait_for(lambda: gate['running'] < gate['slots'], gate['timeout']):
+                    counts['timed_out'] += 1
+            finally:
+                gate['waiting'] -= 1
+        if gate['running'] >= gate['slots']:
+            decision = 'downgrade' if downgradable else 'reject'
+            counts['downgraded' if downgradable else 'rejected'] += 1
+            return decision
+        gate['running'] += 1
+        counts['admitted'] += 1
+        return 'run'
+
+# Function to give back the slot taken by a plan admitted with 'run'
+def release(gate):
+    with gate['condition']:
+        gate['running'] -= 1
+        gate['condition'].notify()
+
+# Function to report the gate's state and counters for monitoring
+def snapshot(gate):
+    with gate['condition']:
+        counts = dict(gate['counts'])
+        return {'pid': os.getpid(), 'running': gate['running'], 'waiting': gate['waiting'], 'slots': gate['slots'],
+                'queue_size': gate['queue_size'], 'shed': counts['downgraded'] + counts['rejected'], **counts,
+                'at': time.time()}
+
+# Function to zero the counters of a gate or a table of in-flight computations, so requests
+# made before serving (a warm-up) do not show in monitoring
+def reset_counts(table):
+    with table['condition'] if 'condition' in table else table['lock']:
+        table['counts'].update(dict.fromkeys(table['counts'], 0))
+
+# Function to build the table of in-flight computations for single_flight
+def make_flights():
+    return {'lock': threading.Lock(), 'calls': {}, 'counts': {'led': 0, 'joined': 0}}
+
+# Function to run compute() once for callers with the same key at the same time: the first
+# caller runs it and the others wait for it and share its result, or its error
+def single_flight(flights, key, compute):
+    with flights['lock']:
+        call = flights['calls'].get(key)
+        leader = call is None
+        if leader:
+            call = flights['calls'][key] = {'done': threading.Event()}
+        flights['counts']['led' if leader else 'joined'] += 1
+    if not leader:
+        call['done'].wait()
+        if 'error' in call:
+            raise call['error']
+        return call['result']
+    try:
+        call['result'] = compute()
+    except Exception as error:
+        call['error'] = error
+        raise
+    finally:
+        with flights['lock']:
+            del flights['calls'][key]
+        call['done'].set()
+    return call['result']
+
+# Function to report coalescing for monitoring: how many requests ran their own plan, how
+# many shared one already running, and the share of requests that were coalesced
+def flight_snapshot(flights):
+    with flights['lock']:
+        counts = dict(flights['counts'])
+        in_flight = len(flights['calls'])
+    total = counts['led'] + counts['joined']
+    return {'in_flight': in_flight, 'coalesced': counts['joined'], 'planned': counts['led'],
+            'coalescing_rate': round(counts['joined'] / total, 3) if total else 0.0}
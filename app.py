@@ -1,191 +1,661 @@
-from flask import Flask, render_template, request
-import random
-
-app = Flask(__name__)
-
-# Function to calculate substitution time
-def calculate_sub_time(minutes, min_sub_time_input, num_players, num_goalkeepers):
-    outfield_players = num_players - num_goalkeepers
-    if not min_sub_time_input:
-        # Calculate a balanced sub time close to dividing playtime evenly among outfield players
-        ideal_sub_time = round(minutes / outfield_players, 1)  # Allow half-minute precision
-        return ideal_sub_time
-
-    min_sub_time = int(min_sub_time_input)
-    ideal_sub_time = minutes // outfield_players
-
-    # Return the greater of the user input and calculated ideal sub time
-    return max(min_sub_time, ideal_sub_time)
-
-# Helper function to conditionally format time
-def format_time(time_value):
-    return f"{time_value:.1f}".rstrip('0').rstrip('.')  # Remove trailing zeros and decimal point if whole
-
-# Game plan generation function with goalie rotation
-def generate_game_plan(minutes, sub_time, game_type, players_data):
-    # Determine number of players on the field based on game type
-    if game_type == "5_a_side":
-        num_players_on_field = 5
-    elif game_type == "6_a_side":
-        num_players_on_field = 6
-    elif game_type == "7_a_side":
-        num_players_on_field = 7
-    elif game_type == "11_a_side":
-        num_players_on_field = 11
-
-    # Calculate number of segments based on game duration and substitution time
-    num_segments = int(minutes / sub_time)  # Convert to integer for use in loop
-    segment_duration = minutes / num_segments
-    playtime_tracker = {player['name']: 0 for player in players_data}
-    substitution_tracker = {player['name']: 0 for player in players_data}
-    goal_time_tracker = {player['name']: 0 for player in players_data}
-
-    game_plan = []
-
-    # Identify the dedicated goalkeeper and any flexible goalkeepers
-    dedicated_goalkeeper = None
-    flexible_goalkeepers = []
-    non_goalkeepers = []
-
-    for player in players_data:
-        if 'goal' in player['positions'] and len(player['positions']) == 1:
-            dedicated_goalkeeper = player['name']
-            break
-        elif 'goal' in player['positions']:
-            flexible_goalkeepers.append(player)
-        else:
-            non_goalkeepers.append(player)
-
-    def prioritize_by_playtime(players, position, assigned_players):
-        return sorted(
-            [player for player in players if position in player['positions'] and player['name'] not in assigned_players],
-            key=lambda p: (playtime_tracker[p['name']], len(p['positions']))
-        )
-
-    flexible_goalkeeper_index = 0
-
-    for segment in range(num_segments):
-        segment_start_time = format_time(segment * segment_duration)
-        segment_end_time = format_time((segment + 1) * segment_duration)
-        segment_plan = {
-            'time': f'{segment_start_time} - {segment_end_time} mins',
-            'positions': {
-                'goal': None,
-                'defense': [],
-                'mid': [],
-                'forward': []
-            },
-            'subs': []
-        }
-
-        assigned_players = set()
-        remaining_field_slots = num_players_on_field
-
-        # Step 1: Assign the goalkeeper
-        if dedicated_goalkeeper:
-            segment_plan['positions']['goal'] = dedicated_goalkeeper
-            assigned_players.add(dedicated_goalkeeper)
-            goal_time_tracker[dedicated_goalkeeper] += 1
-            remaining_field_slots -= 1
-        elif flexible_goalkeepers:
-            current_goalkeeper = flexible_goalkeepers[flexible_goalkeeper_index % len(flexible_goalkeepers)]['name']
-            segment_plan['positions']['goal'] = current_goalkeeper
-            assigned_players.add(current_goalkeeper)
-            goal_time_tracker[current_goalkeeper] += 1
-            flexible_goalkeeper_index += 1
-            remaining_field_slots -= 1
-
-        # Step 2: Assign players to other positions based on playtime, ensuring fair rotation
-        for position in ["defense", "mid", "forward"]:
-            # Determine required players for each position
-            if position == "defense":
-                needed = 1  # Allow flexibility here for single-player defense
-            elif position == "mid":
-                needed = (num_players_on_field - 1 - len(segment_plan['positions']['defense'])) // 2
-            else:  # position == "forward"
-                needed = num_players_on_field - 1 - len(segment_plan['positions']['defense']) - len(segment_plan['positions']['mid'])
-
-            # Prioritize players with less playtime for each position
-            preferred_players = prioritize_by_playtime(players_data, position, assigned_players)
-            for player in preferred_players[:needed]:
-                segment_plan['positions'][position].append(player['name'])
-                assigned_players.add(player['name'])
-                playtime_tracker[player['name']] += sub_time
-                remaining_field_slots -= 1
-
-        # NEW STEP: If any slots remain, rotate other players into available positions based on playtime
-        if remaining_field_slots > 0:
-            remaining_players = [p for p in players_data if p['name'] not in assigned_players]
-            prioritized_remaining_players = sorted(remaining_players, key=lambda p: playtime_tracker[p['name']])
-
-            for player in prioritized_remaining_players:
-                if remaining_field_slots == 0:
-                    break
-                if 'defense' in player['positions'] and len(segment_plan['positions']['defense']) < 2:
-                    segment_plan['positions']['defense'].append(player['name'])
-                elif 'mid' in player['positions'] and len(segment_plan['positions']['mid']) < 3:
-                    segment_plan['positions']['mid'].append(player['name'])
-                elif 'forward' in player['positions'] and len(segment_plan['positions']['forward']) < 2:
-                    segment_plan['positions']['forward'].append(player['name'])
-                assigned_players.add(player['name'])
-                playtime_tracker[player['name']] += sub_time
-                remaining_field_slots -= 1
-
-        # Step 4: Assign remaining players as substitutes if no field slots are left
-        players_not_assigned = [p for p in players_data if p['name'] not in assigned_players]
-        for player in players_not_assigned:
-            segment_plan['subs'].append(player['name'])
-            substitution_tracker[player['name']] += 1
-
-        game_plan.append(segment_plan)
-
-    # Generate summary of time spent in goal, on field, and as substitutes
-    summary = {
-        player['name']: {
-            'goal_segments': goal_time_tracker[player['name']],
-            'sub_segments': substitution_tracker[player['name']],
-            'field_segments': num_segments - substitution_tracker[player['name']] - goal_time_tracker[player['name']],
-            'mins_off': substitution_tracker[player['name']] * sub_time,
-            'mins_subbed_goal': (substitution_tracker[player['name']] + goal_time_tracker[player['name']]) * sub_time
-        } for player in players_data
-    }
-
-    return game_plan, summary
+from flask import Blueprint, Flask, Request, current_app, g, render_template, request, url_for
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+import contextlib
+import datetime
+import functools
+import hashlib
+import json
+import math
+import os
+import time
+
+import admission
+import audit
+from planner import (CONSTRAINT_RULES, FIXTURE_DEFAULTS, GAME_TYPES, POSITION_LABELS, SPORT_PROFILES, SUB_PROFILES,
+                     build_timeline, calculate_sub_time, count_pairings, format_time, generate_game_plan,
+                     generate_line_plan, generate_split_plans, generate_tournament_plan, parse_quotas)
+
+# Web front end for the planners in planner.py. Routes live on a blueprint that
+# create_app registers, so importing this module builds one app for gunicorn (app:app)
+# while scripts and tests can build their own.
+views = Blueprint('views', __name__)
+
+# Default request limits: body size in bytes, form fields (each value of a repeated field
+# counts), players in one squad, segments in one match, matches in one tournament day and
+# pitches the squad can be split across
+MAX_CONTENT_LENGTH = 256 * 1024
+MAX_FORM_PARTS = 1000
+MAX_SQUAD_SIZE = 60
+MAX_SEGMENTS = 120
+MAX_MATCHES = 8
+MAX_PITCHES = 6
+
+# Default admission control, per process: heavy plans running at once, heavy plans that
+# may wait for a slot and for how many seconds, and the estimated milliseconds that make
+# a plan heavy (see admission.py)
+PLAN_SLOTS = 1
+PLAN_QUEUE_SIZE = 4
+PLAN_QUEUE_TIMEOUT = 2.0
+HEAVY_PLAN_MS = 20.0
+
+# Default background jobs: threads per process planning jobs, and fixtures in one job
+JOB_WORKERS = 1
+MAX_JOB_FIXTURES = 500
+
+# Default audit log rotation: bytes per file and rotated files kept
+AUDIT_MAX_BYTES = 10 * 1024 * 1024
+AUDIT_BACKUPS = 5
+
+# Request class that takes the multipart form limit from the app config, the way Flask
+# already does for MAX_CONTENT_LENGTH
+class PlanRequest(Request):
+    @property
+    def max_form_parts(self):
+        if current_app:
+            return current_app.config['MAX_FORM_PARTS']
+        return super().max_form_parts
+
+# Raised when a plan request is over one of the request limits
+class RequestTooLarge(ValueError):
+    pass
+
+# Application factory. The season ledger lives in the instance folder unless LEDGER_PATH
+# (or `config`) says otherwise; it is only imported and opened once a team uses it.
+# Compiled templates go to a bytecode cache on disk (TEMPLATE_CACHE_DIR, None to turn it
+# off) that every worker and restart reuses, and templates are not checked for changes.
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config['LEDGER_PATH'] = os.environ.get('LEDGER_PATH') or os.path.join(app.instance_path, 'season.db')
+    app.config['JOBS_PATH'] = os.environ.get('JOBS_PATH') or os.path.join(app.instance_path, 'jobs.db')
+    app.config['AUDIT_LOG_PATH'] = (os.environ.get('AUDIT_LOG_PATH')
+                                    or os.path.join(app.instance_path, 'logs', 'audit.jsonl'))
+    app.config['TEMPLATE_CACHE_DIR'] = (os.environ.get('TEMPLATE_CACHE_DIR')
+                                        or os.path.join(app.instance_path, 'template_cache'))
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    app.config['MAX_FORM_PARTS'] = MAX_FORM_PARTS
+    app.config['MAX_SQUAD_SIZE'] = MAX_SQUAD_SIZE
+    app.config['MAX_SEGMENTS'] = MAX_SEGMENTS
+    app.config['MAX_MATCHES'] = MAX_MATCHES
+    app.config['MAX_PITCHES'] = MAX_PITCHES
+    app.config['PLAN_SLOTS'] = PLAN_SLOTS
+    app.config['PLAN_QUEUE_SIZE'] = PLAN_QUEUE_SIZE
+    app.config['PLAN_QUEUE_TIMEOUT'] = PLAN_QUEUE_TIMEOUT
+    app.config['HEAVY_PLAN_MS'] = HEAVY_PLAN_MS
+    app.config['JOB_WORKERS'] = JOB_WORKERS
+    app.config['MAX_JOB_FIXTURES'] = MAX_JOB_FIXTURES
+    app.config['AUDIT_MAX_BYTES'] = AUDIT_MAX_BYTES
+    app.config['AUDIT_BACKUPS'] = AUDIT_BACKUPS
+    app.config.update(config or {})
+    app.request_class = PlanRequest
+    app.extensions['plan_flights'] = admission.make_flights()
+    app.extensions['audit_log'] = (audit.make_log(app.config['AUDIT_LOG_PATH'], app.config['AUDIT_MAX_BYTES'],
+                                                  app.config['AUDIT_BACKUPS'])
+                                   if app.config['AUDIT_LOG_PATH'] else None)
+    app.extensions['plan_gate'] = admission.make_gate(app.config['PLAN_SLOTS'], app.config['PLAN_QUEUE_SIZE'],
+                                                      app.config['PLAN_QUEUE_TIMEOUT'], app.config['HEAVY_PLAN_MS'])
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = {**app.jinja_options,
+                             'bytecode_cache': FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])}
+    app.add_template_filter(format_time)
+    app.add_template_global(POSITION_LABELS, 'position_labels')
+    app.add_template_global(segment_renderer(app), 'segment_html')
+    app.register_blueprint(views)
+
+    @app.cli.command('precompile-templates')
+    def precompile_command():
+        """Compile every template into the bytecode cache."""
+        precompile_templates(app)
+
+    return app
+
+# Rendered segments kept per app; a long plan page has a few hundred
+SEGMENT_CACHE_SIZE = 4096
+
+# Function to build the segment_html template global. It renders one plan segment with
+# the macro in segment.html, caching the HTML by everything the markup depends on, so
+# identical segments and repeat renders of a plan reuse it. While templates auto-reload
+# (development) it renders every time, so template edits show up.
+def segment_renderer(app):
+    @functools.lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+    def render_cached(key):
+        return app.jinja_env.get_template('segment.html').module.segment(*key)
+
+    def segment_html(segment, prefix, index):
+        positions = tuple((position, players if players is None or isinstance(players, str) else tuple(players))
+                          for position, players in segment['positions'].items())
+        key = (segment['time'], positions, tuple(segment['subs']), tuple(segment['unavailable']), prefix, index)
+        if app.config['TEMPLATES_AUTO_RELOAD']:
+            return render_cached.__wrapped__(key)
+        return render_cached(key)
+
+    segment_html.cache_info = render_cached.cache_info
+    return segment_html
+
+# Function to compile every template ahead of the first request, filling the bytecode
+# cache: run `flask --app app precompile-templates` at build time, and the gunicorn
+# profile does it at startup
+def precompile_templates(app):
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+# Helper function to load the season ledger module on first use and make sure the
+# folder for its database exists
+def season_ledger():
+    import ledger
+    os.makedirs(os.path.dirname(current_app.config['LEDGER_PATH']) or '.', exist_ok=True)
+    return ledger
+
+# Fields sent for each player, numbered from 1 as <field>_<number>
+PLAYER_FIELDS = ('player_name', 'positions', 'rating', 'stamina', 'quotas', 'arrives', 'leaves')
+
+# Function to turn a JSON plan request into the fields the form sends. The body holds the
+# form's settings plus the squad as a list, e.g.
+#   {"minutes": 40, "game_type": "7_a_side", "players": [{"name": "Sam", "positions": ["mid"]}]}
+def json_fields(body, max_squad):
+    if not isinstance(body, dict) or not isinstance(body.get('players'), list):
+        raise ValueError('A JSON plan request needs an object with a list of players')
+    if len(body['players']) > max_squad:
+        raise RequestTooLarge(f'At most {max_squad} players can be planned at once')
+    fields = MultiDict((key, str(value)) for key, value in body.items()
+                       if key != 'players' and isinstance(value, (str, int, float)))
+    fields['players'] = str(len(body['players']))
+    for number, player in enumerate(body['players'], start=1):
+        if not isinstance(player, dict):
+            raise ValueError(f'Player {number} must be an object')
+        for field in PLAYER_FIELDS:
+            value = player.get('name' if field == 'player_name' else field)
+            if isinstance(value, list):
+                fields.setlist(f'{field}_{number}', [str(item) for item in value])
+            elif value is not None:
+                fields[f'{field}_{number}'] = str(value)
+    return fields
+
+# Numeric settings a plan request may send: how each is read, its name in error messages
+# and the least it may be. Blank fields are left out.
+NUMBER_FIELDS = {
+    'minutes': (int, 'Match length', 1),
+    'sub_time': (float, 'Minimum sub time', 0),
+    'shift': (float, 'Minutes per shift', 0),
+    'periods': (int, 'Number of periods', 1),
+    'pitches': (int, 'Games at the same time', 1),
+    'num_matches': (int, 'Matches today', 1),
+    'gap': (float, 'Minutes between matches', 0),
+    'min_rest': (float, 'Minimum rest between matches', 0),
+    'max_subs': (int, 'Most substitutions', 0),
+    'max_windows': (int, 'Most substitution windows', 0),
+    'max_bench_streak': (int, 'Most segments on the bench in a row', 0),
+    'min_stint': (float, 'Minimum minutes per stint', 0),
+    'min_minutes': (float, 'Minimum minutes per player', 0),
+}
+
+# Helper function to read the numeric settings from the request fields, turning bad input
+# into a ValueError that names the setting
+def read_numbers(fields):
+    numbers = {}
+    for name, (convert, label, minimum) in NUMBER_FIELDS.items():
+        value = (fields.get(name) or '').strip()
+        if not value:
+            continue
+        kind = 'whole number' if convert is int else 'number'
+        try:
+            number = convert(value)
+        except ValueError:
+            raise ValueError(f'{label} must be a {kind}') from None
+        if not math.isfinite(number) or number < minimum:
+            raise ValueError(f'{label} must be a {kind} of at least {minimum}')
+        numbers[name] = number
+    return numbers
+
+# Function to read a plan request, form or JSON, into one set of fields and its parsed
+# settings, checking the request limits before anything is planned
+def read_plan_request():
+    config = current_app.config
+    if request.is_json:
+        fields = json_fields(request.get_json(silent=True), config['MAX_SQUAD_SIZE'])
+    else:
+        fields = request.form
+    if sum(len(values) for values in fields.listvalues()) > config['MAX_FORM_PARTS']:
+        raise RequestTooLarge(f"At most {config['MAX_FORM_PARTS']} form fields can be sent at once")
+    return fields, read_settings(fields, config)
+
+# Function to parse the settings of a plan from its fields and check them against the
+# request limits in `config`. The settings hold the squad size, every number sent, the
+# substitution points, the sub time the plan will use and the number of segments in the
+# match timeline.
+def read_settings(fields, config):
+    try:
+        players = int(fields.get('players') or '')
+    except ValueError:
+        raise ValueError('Number of players must be a whole number') from None
+    if players > config['MAX_SQUAD_SIZE']:
+        raise RequestTooLarge(f"At most {config['MAX_SQUAD_SIZE']} players can be planned at once")
+    if players < 2:
+        raise ValueError('Plans need at least two players')
+
+    settings = {'players': players, 'periods': 1, 'pitches': 1, 'num_matches': 1, **read_numbers(fields)}
+    if 'minutes' not in settings:
+        raise ValueError('Match length must be a whole number')
+    if settings['pitches'] > config['MAX_PITCHES']:
+        raise RequestTooLarge(f"At most {config['MAX_PITCHES']} games can be planned at the same time")
+    if settings['num_matches'] > config['MAX_MATCHES']:
+        raise RequestTooLarge(f"At most {config['MAX_MATCHES']} matches can be planned in one day")
+    settings['sub_points'] = None
+    if (fields.get('sub_points') or '').strip():
+        try:
+            settings['sub_points'] = [float(point) for point in fields.get('sub_points').split(',') if point.strip()]
+        except ValueError:
+            raise ValueError('Substitution points must be minutes separated by commas') from None
+
+    # Count the segments of the match timeline, making sure it is small enough to lay out first
+    minutes = settings['minutes']
+    settings['sub_time_input'] = settings.pop('sub_time', None)
+    settings['sub_time'] = calculate_sub_time(minutes, settings['sub_time_input'], players, num_goalkeepers=1)
+    sport = fields.get('sport') or 'football'
+    if sport == 'football':
+        periods, sub_points, step = settings['periods'], settings['sub_points'], settings['sub_time']
+    elif sport in SPORT_PROFILES:
+        periods, sub_points = SPORT_PROFILES[sport]['periods'], None
+        step = settings.get('shift') or SPORT_PROFILES[sport]['shift']
+    else:
+        raise ValueError(f'Unknown sport: {sport}')
+    too_many = RequestTooLarge(f"At most {config['MAX_SEGMENTS']} segments can be planned in one match")
+    if periods > config['MAX_SEGMENTS'] or len(sub_points or ()) > config['MAX_SEGMENTS']:
+        raise too_many
+    if sub_points is None and minutes / max(step, 1e-9) > config['MAX_SEGMENTS']:
+        raise too_many
+    settings['segments'] = len(build_timeline(minutes, step, periods, sub_points)['bounds'])
+    if settings['segments'] > config['MAX_SEGMENTS']:
+        raise too_many
+    return settings
+
+# Helper function to read one of a player's numeric fields, turning bad input into a
+# ValueError that names the player and the field
+def read_player_number(name, label, value):
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{name}'s {label} must be a number") from None
+    if not math.isfinite(number):
+        raise ValueError(f"{name}'s {label} must be a number")
+    return number
+
+# Function to build the squad from the request fields in one pass over them. Fields
+# numbered past the squad size are ignored and every player gets the defaults for what
+# they left out.
+def read_roster(fields, players, minutes):
+    player_fields = [{} for _ in range(players)]
+    for key, values in fields.lists():
+        field, _, number = key.rpartition('_')
+        if field in PLAYER_FIELDS and number.isdigit() and 0 < int(number) <= players:
+            player_fields[int(number) - 1][field] = values
+
+    player_data = []
+    for i, values in enumerate(player_fields, start=1):
+        first = {field: values[field][0] for field in values}
+        player = {'name': first.get('player_name') or f'Player {i}',
+                  'positions': values.get('positions') or ['defense', 'mid', 'forward', 'goal']}
+        # Optional rating for balanced mode
+        if first.get('rating'):
+            player['rating'] = read_player_number(player['name'], 'rating', first['rating'])
+        # Optional stamina: minutes the player can play before needing a rest
+        if first.get('stamina'):
+            player['stamina'] = read_player_number(player['name'], 'stamina', first['stamina'])
+        # Optional position quotas, as percentages of the player's outfield minutes
+        if first.get('quotas'):
+            player['quotas'] = parse_quotas(first['quotas'])
+        # Optional availability window for players arriving late or leaving early
+        if first.get('arrives') or first.get('leaves'):
+            player['available'] = (read_player_number(player['name'], 'arrival minute', first.get('arrives') or 0),
+                                   read_player_number(player['name'], 'leaving minute', first.get('leaves') or minutes))
+        player_data.append(player)
+    return player_data
+
+# Function to list a plan request's settings: every field but the per-player ones, in a
+# fixed order
+def plan_settings(form):
+    return sorted((key, values) for key, values in form.lists() if key.rpartition('_')[0] not in PLAYER_FIELDS)
+
+# Function to build the canonical signature of a plan request: the parsed squad and the
+# settings, hashed
+def plan_signature(form, player_data):
+    return hashlib.sha256(json.dumps([plan_settings(form), player_data], sort_keys=True).encode()).hexdigest()
+
+# Function to hash a finished plan (or list of plans) for the audit log
+def plan_digest(plan):
+    return hashlib.sha256(json.dumps(plan, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# Function to start an audit entry for this request, if the audit log is on. Stages are
+# timed as laps: each audit_stage call closes the stage that ran since the previous one.
+def start_audit():
+    if current_app.extensions['audit_log'] is not None:
+        now = time.perf_counter()
+        g.audit = {'entry': {'at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+                             'endpoint': request.path, 'timings': {}},
+                   'started': now, 'lap': now}
+
+# Function to close the current stage of this request's audit entry as `name`, in
+# milliseconds, and add any other fields to the entry
+def audit_stage(name, **fields):
+    audit_state = g.get('audit')
+    if audit_state is not None:
+        now = time.perf_counter()
+        audit_state['entry']['timings'][name] = round((now - audit_state['lap']) * 1000, 2)
+        audit_state['lap'] = now
+        audit_state['entry'].update(fields)
+
+# After-request hook that closes the last stage (rendering the response), adds the status
+# and total time, and hands the entry to the audit log's background writer
+@views.after_app_request
+def record_audit(response):
+    audit_stage('render', status=response.status_code)
+    audit_state = g.pop('audit', None)
+    if audit_state is not None:
+        entry = audit_state['entry']
+        entry['total_ms'] = round((audit_state['lap'] - audit_state['started']) * 1000, 2)
+        audit.record(current_app.extensions['audit_log'], entry)
+    return response
+
+# Handler for bodies over MAX_CONTENT_LENGTH and multipart forms over MAX_FORM_PARTS
+@views.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return render_template('form.html', game_types=GAME_TYPES, error='That request is too large to plan'), 413
+
+# Function to put a plan request through admission control. The cost is estimated from
+# the squad, the number of segments in the match timeline and of plans, the mode and the
+# searches the rules need. Only plans that need no search and are not already greedy can
+# be downgraded. A plan that gets a slot holds it until the request is torn down.
+def admit_plan(players, segments, mode, searches, plans):
+    gate = current_app.extensions['plan_gate']
+    cost = admission.estimate_cost(segments, players, mode, searches, plans)
+    decision = admission.admit(gate, cost, downgradable=not searches and mode != 'greedy')
+    if decision == 'run':
+        g.plan_gate = gate
+    return decision
+
+# Teardown that gives back the admission slot a request held
+@views.teardown_app_request
+def release_plan_slot(error):
+    gate = g.pop('plan_gate', None)
+    if gate is not None:
+        admission.release(gate)
+
+# Route to report this process's admission queue, shed counts and coalesced requests for
+# monitoring
+@views.route('/metrics')
+def metrics():
+    audit_log = current_app.extensions['audit_log']
+    return {**admission.snapshot(current_app.extensions['plan_gate']),
+            **admission.flight_snapshot(current_app.extensions['plan_flights']),
+            **(audit.snapshot(audit_log) if audit_log else {})}
+
+# Helper function to load the background jobs module on first use, with this app's job
+# runner (its threads only start with the first job)
+def job_queue():
+    import jobs
+    runner = current_app.extensions.get('plan_jobs')
+    if runner is None:
+        os.makedirs(os.path.dirname(current_app.config['JOBS_PATH']) or '.', exist_ok=True)
+        runner = current_app.extensions.setdefault(
+            'plan_jobs', jobs.make_runner(current_app.config['JOBS_PATH'], current_app.config['JOB_WORKERS']))
+    return jobs, runner
+
+# Helper function to check a job fixture against the same settings and limits as a plan
+# request. Its rules are read with the other numbers. The bulk planner uses a fixture's
+# sub time as it is rather than as a minimum, and as the shift length in line sports, so
+# the segments are counted that way too.
+def read_fixture_settings(fixture):
+    config = current_app.config
+    rules = fixture.get('rules') or {}
+    if not isinstance(rules, dict):
+        raise ValueError('Rules must be an object')
+    fixture = {**FIXTURE_DEFAULTS, **rules, **fixture}
+    if fixture['sport'] != 'football':
+        fixture['shift'] = fixture.get('sub_time')
+    settings = read_settings(json_fields(fixture, config['MAX_SQUAD_SIZE']), config)
+    sub_time = settings['sub_time_input']
+    if fixture['sport'] == 'football' and sub_time and settings['minutes'] / sub_time > config['MAX_SEGMENTS']:
+        raise RequestTooLarge(f"At most {config['MAX_SEGMENTS']} segments can be planned in one match")
+    return settings
+
+# Route to queue a background job planning a batch of fixtures, sent as JSON in the bulk
+# CLI's fixture format:
+#   {"fixtures": [{"fixture": "U10 v Reds", "minutes": 40, "players": [{"name": "Sam", ...}]}, ...]}
+@views.route('/jobs', methods=['POST'])
+def submit_job():
+    start_audit()
+    body = request.get_json(silent=True)
+    fixtures = body.get('fixtures') if isinstance(body, dict) else None
+    if not fixtures or not isinstance(fixtures, list) or not all(isinstance(fixture, dict) for fixture in fixtures):
+        return {'error': 'Send a JSON object with a non-empty list of fixtures'}, 400
+    if len(fixtures) > current_app.config['MAX_JOB_FIXTURES']:
+        return {'error': f"At most {current_app.config['MAX_JOB_FIXTURES']} fixtures can be planned in one job"}, 413
+    for number, fixture in enumerate(fixtures, start=1):
+        try:
+            read_fixture_settings(fixture)
+        except RequestTooLarge as error:
+            return {'error': f"{fixture.get('fixture') or f'Fixture {number}'}: {error}"}, 413
+        except ValueError as error:
+            return {'error': f"{fixture.get('fixture') or f'Fixture {number}'}: {error}"}, 400
+    jobs, runner = job_queue()
+    job_id = jobs.submit(runner, fixtures)
+    audit_stage('queue', job=job_id, fixtures=len(fixtures), players=sum(len(fixture.get('players') or [])
+                                                                         for fixture in fixtures))
+    status_url = url_for('views.job_status', job_id=job_id)
+    return ({'id': job_id, 'status': 'queued', 'status_url': status_url,
+             'result_url': url_for('views.job_result', job_id=job_id)}, 202, {'Location': status_url})
+
+# Route to poll a job's status and progress
+@views.route('/jobs/<job_id>')
+def job_status(job_id):
+    jobs, _ = job_queue()
+    with contextlib.closing(jobs.connect(current_app.config['JOBS_PATH'])) as conn:
+        job = jobs.status(conn, job_id)
+    return job if job else ({'error': 'No such job'}, 404)
+
+# Route to fetch a finished job's plans; until then it answers 409 with the job's status
+@views.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    jobs, _ = job_queue()
+    with contextlib.closing(jobs.connect(current_app.config['JOBS_PATH'])) as conn:
+        job = jobs.status(conn, job_id)
+        plans = jobs.result(conn, job_id) if job else None
+    if job is None:
+        return {'error': 'No such job'}, 404
+    if plans is None:
+        return job, 409
+    return {**job, 'plans': plans}
+
+# Route to cancel a queued or running job; a finished job answers 409
+@views.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    jobs, _ = job_queue()
+    with contextlib.closing(jobs.connect(current_app.config['JOBS_PATH'])) as conn:
+        cancelled = jobs.cancel(conn, job_id)
+        job = jobs.status(conn, job_id)
+    if job is None:
+        return {'error': 'No such job'}, 404
+    return job if cancelled else (job, 409)
 
 # Route to display the initial form
-@app.route('/')
+@views.route('/')
 def form():
-    return render_template('form.html')
+    return render_template('form.html', game_types=GAME_TYPES)
 
 # Route to submit the form and display the game plan
-@app.route('/submit', methods=['POST'])
+@views.route('/submit', methods=['POST'])
 def submit():
+    start_audit()
+    # Read the request within its limits before any planning
+    try:
+        form, settings = read_plan_request()
+    except RequestTooLarge as error:
+        return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 413
+    except ValueError as error:
+        return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 400
+
     # Get form data
-    minutes = int(request.form.get('minutes'))
-    game_type = request.form.get('game_type')
-    players = int(request.form.get('players'))
+    players = settings['players']
+    minutes = settings['minutes']
+    game_type = form.get('game_type')
+    mode = form.get('mode') or 'greedy'
+    goal_blocks = form.get('goal_blocks') or 'half'
+    # Optional rules for the constraint layer; blank fields are ignored
+    rules = {rule: settings[rule] for rule in CONSTRAINT_RULES if rule in settings}
+    # Optional substitution rules: a competition profile, with its limits overridable
+    sub_profile = form.get('sub_profile') or 'rolling'
+    if sub_profile not in SUB_PROFILES:
+        return render_template('form.html', game_types=GAME_TYPES, error=f"Unknown substitution rules: {sub_profile}"), 400
+    sub_rules = dict(SUB_PROFILES[sub_profile])
+    for limit in ('max_subs', 'max_windows'):
+        if limit in settings:
+            sub_rules[limit] = settings[limit]
+    # Optional timeline: periods (halves, quarters) and explicit substitution minutes
+    periods = settings['periods']
+    sub_points = settings['sub_points']
+    # Optional formation, with a comma between the first and second half shapes
+    formation = [name.strip() for name in (form.get('formation') or '').split(',') if name.strip()]
     
-    # Get the minimum sub time, which could be blank
-    min_sub_time_input = request.form.get('sub_time')
-    sub_time = calculate_sub_time(minutes, min_sub_time_input, players, num_goalkeepers=1)
+    # The sub time the plan uses, from the minimum sub time, which could be blank
+    min_sub_time_input = settings.get('sub_time_input')
+    sub_time = settings['sub_time']
 
     # Process player data with defaults
-    player_data = []
-    for i in range(1, players + 1):
-        name = request.form.get(f'player_name_{i}') or f'Player {i}'
-        positions = request.form.getlist(f'positions_{i}')
-        if not positions:
-            positions = ['defense', 'mid', 'forward', 'goal']
-        player_data.append({'name': name, 'positions': positions})
-
-    # Generate game plan and summary
-    game_plan, summary = generate_game_plan(minutes, sub_time, game_type, player_data)
-
-    # Pass game_plan, summary, and sub_time to the template
-    return render_template('game_plan.html', game_plan=game_plan, summary=summary, sub_time=sub_time)
+    try:
+        player_data = read_roster(form, players, minutes)
+    except ValueError as error:
+        return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 400
+
+    # Identical requests arriving together (a shared form link) share one run of
+    # everything below: admission, planning, the ledger and the rendered page
+    def plan_and_render():
+        nonlocal mode
+        # Heavy plans wait for a slot; when the planner is saturated they fall back to fair
+        # playtime, or are turned away if their rules need the solver
+        pitches = settings['pitches']
+        num_matches = settings['num_matches']
+        segments = settings['segments']
+        searches = bool(rules) + any(sub_rules[limit] is not None for limit in ('max_subs', 'max_windows'))
+        requested_mode = mode
+        decision = admit_plan(players, segments, mode, searches, num_matches * pitches)
+        audit_stage('admission', coalesced=False, admission=decision, mode=mode, estimated_segments=segments)
+        if decision == 'reject':
+            error = 'The planner is busy with other plans; try again in a few seconds'
+            return render_template('form.html', game_types=GAME_TYPES, error=error), 503, {'Retry-After': '5'}
+        if decision == 'downgrade':
+            mode = 'greedy'
+
+        # With a team name, seed priorities from the season ledger and record the plan in it:
+        # one match, each game on split pitches as "<match> pitch <number>", or each match of
+        # a tournament day as "<match> match <number>"
+        team = (form.get('team') or '').strip()
+        match = (form.get('match') or '').strip() or datetime.date.today().isoformat()
+        sport = form.get('sport') or 'football'
+        match_names = [match]
+        if sport == 'football' and pitches > 1:
+            match_names = [f'{match} pitch {index}' for index in range(1, pitches + 1)]
+        elif sport == 'football' and num_matches > 1:
+            match_names = [f'{match} match {index}' for index in range(1, num_matches + 1)]
+        carry_over = None
+        pair_history = None
+        if team:
+            ledger = season_ledger()
+            with contextlib.closing(ledger.connect(current_app.config['LEDGER_PATH'])) as season:
+                carry_over = ledger.carry_over(season, team, {player['name'] for player in player_data}, match_names)
+                pair_history = ledger.pair_history(season, team, {player['name'] for player in player_data},
+                                                   match_names)
+            audit_stage('ledger')
+
+        # Function to record the (game_plan, summary) for each of match_names in the ledger
+        def record_plans(plans):
+            if team:
+                with contextlib.closing(ledger.connect(current_app.config['LEDGER_PATH'])) as season:
+                    for name, (game_plan, summary) in zip(match_names, plans):
+                        ledger.record_match(season, team, name, summary, pairings=count_pairings(game_plan))
+                audit_stage('record')
+
+        # Line-change sports rotate whole lines rather than planning football substitutions
+        if sport != 'football':
+            stats = {}
+            try:
+                game_plan, summary = generate_line_plan(minutes, settings.get('shift') or 0, sport, player_data,
+                                                        goal_blocks=goal_blocks, stats=stats)
+            except ValueError as error:
+                return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 400
+            audit_stage('plan', engine=f'lines:{sport}', plan_hash=plan_digest(game_plan))
+            record_plans([(game_plan, summary)])
+            return render_template('game_plan.html', game_plan=game_plan, summary=summary, sub_time=sub_time, stats=stats)
+
+        # Simultaneous games split the squad across pitches and plan each game
+        if pitches > 1 and num_matches > 1:
+            error = 'Plan either several pitches at once or several matches in a row, not both'
+            return render_template('form.html', game_types=GAME_TYPES, error=error), 400
+        if pitches > 1:
+            try:
+                groups, plans = generate_split_plans(minutes, [game_type] * pitches, player_data, mode=mode,
+                                                     formations=[formation] * pitches, rules=rules,
+                                                     goal_blocks=goal_blocks, carry_over=carry_over,
+                                                     min_sub_time_input=min_sub_time_input, sub_rules=sub_rules,
+                                                     periods=periods, sub_points=sub_points)
+            except ValueError as error:
+                return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 400
+            audit_stage('plan', engine='split', plan_hash=plan_digest(plans))
+            record_plans(plans)
+            matches = [
+                {'title': f'Pitch {index}', 'prefix': f'{index}_', 'game_plan': game_plan, 'summary': summary,
+                 'sub_time': calculate_sub_time(minutes, min_sub_time_input, len(group), num_goalkeepers=1), 'stats': {}}
+                for index, (group, (game_plan, summary)) in enumerate(zip(groups, plans), start=1)
+            ]
+            return render_template('game_plan.html', matches=matches)
+
+        # Tournament days plan several back-to-back matches with the same settings together
+        if num_matches > 1:
+            match_settings = {'minutes': minutes, 'sub_time': sub_time, 'game_type': game_type, 'formation': formation,
+                              'rules': rules, 'sub_rules': sub_rules, 'periods': periods, 'sub_points': sub_points,
+                              'gap': settings.get('gap', 0)}
+            try:
+                plans, day_summary = generate_tournament_plan([match_settings] * num_matches, player_data, mode=mode,
+                                                              goal_blocks=goal_blocks,
+                                                              min_rest=settings.get('min_rest', 0),
+                                                              carry_over=carry_over)
+            except ValueError as error:
+                return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 400
+            audit_stage('plan', engine='tournament', plan_hash=plan_digest(plans))
+            record_plans(plans)
+            matches = [
+                {'title': f'Match {index}', 'prefix': f'{index}_', 'game_plan': game_plan, 'summary': summary,
+                 'sub_time': sub_time, 'stats': {}}
+                for index, (game_plan, summary) in enumerate(plans, start=1)
+            ]
+            return render_template('game_plan.html', matches=matches, day_summary=day_summary)
+
+        # Generate game plan and summary
+        stats = {}
+        try:
+            game_plan, summary = generate_game_plan(minutes, sub_time, game_type, player_data, mode=mode, stats=stats,
+                                                    formation=formation, rules=rules, goal_blocks=goal_blocks,
+                                                    carry_over=carry_over, pair_history=pair_history,
+                                                    sub_rules=sub_rules, periods=periods, sub_points=sub_points)
+        except ValueError as error:
+            return render_template('form.html', game_types=GAME_TYPES, error=str(error)), 400
+        if decision == 'downgrade':
+            stats['downgraded_from'] = requested_mode
+        audit_stage('plan', engine='match', plan_hash=plan_digest(game_plan))
+        record_plans([(game_plan, summary)])
+
+        # Pass game_plan, summary, sub_time and the plan stats to the template
+        return render_template('game_plan.html', game_plan=game_plan, summary=summary, sub_time=sub_time, stats=stats)
+
+    audit_stage('parse', params={key: values[0] if len(values) == 1 else values for key, values in plan_settings(form)},
+                players=players, coalesced=True)
+    signature = plan_signature(form, player_data)
+    return admission.single_flight(current_app.extensions['plan_flights'], signature, plan_and_render)
 
 # Route to update the game plan after editing
-@app.route('/update_game_plan', methods=['POST'])
+@views.route('/update_game_plan', methods=['POST'])
 def update_game_plan():
     # Extract the updated team sheet data from the form
     updated_data = request.form.to_dict()
@@ -199,7 +669,12 @@ def update_game_plan():
     # After updating, render the updated game plan
     return render_template('game_plan.html', game_plan=game_plan, summary=summary, sub_time=sub_time)
 
+app = create_app()
+
 if __name__ == '__main__':
+    # The Jinja environment is already built, so it has to be told to reload templates too
+    app.config['TEMPLATES_AUTO_RELOAD'] = True
+    app.jinja_env.auto_reload = True
     app.run(debug=True, host='0.0.0.0', port=5001)
 
 
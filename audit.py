@@ -0,0 +1,108 @@
+import atexit
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+
+# Append-only audit log of plan requests, as JSON Lines. Requests only put their entry on
+# an in-memory queue; a background thread writes the entries out in batches and rotates
+# the file by size, so no disk I/O happens on the request path. If the queue is ever full
+# the entry is dropped and counted rather than making the request wait. Every worker
+# process of a server appends to the same file, taking a lock on path.lock around the size
+# check, rotation and write so that one never rotates while another writes.
+
+# Entries written in one go, and the most seconds an entry waits to be written
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+
+# Entries held in memory before new ones are dropped
+QUEUE_SIZE = 10000
+
+# Function to build an audit log writing to `path`, rotated to path.1 .. path.<backups>
+# once it would grow past `max_bytes`. The writer thread starts with the first entry,
+# and a forked child starts its own, so a preloading server can fork safely.
+def make_log(path, max_bytes, backups):
+    log = {'path': path, 'max_bytes': max_bytes, 'backups': backups, 'counts': {'written': 0, 'dropped': 0}}
+    _reset(log)
+    os.register_at_fork(after_in_child=lambda: _reset(log))
+    return log
+
+# Helper function to give the log a fresh queue and no writer thread
+def _reset(log):
+    log['lock'] = threading.Lock()
+    log['queue'] = queue.Queue(QUEUE_SIZE)
+    log['thread'] = None
+
+# Function to add an entry (a dict that JSON can encode) to the log without blocking
+def record(log, entry):
+    if log['thread'] is None:
+        with log['lock']:
+            if log['thread'] is None:
+                log['thread'] = threading.Thread(target=_write_batches, args=(log, log['queue']), name='audit-log',
+                                                 daemon=True)
+                log['thread'].start()
+                atexit.register(close, log)
+    try:
+        log['queue'].put_nowait(json.dumps(entry, default=str) + '\n')
+    except queue.Full:
+        log['counts']['dropped'] += 1
+
+# Function to write out what is queued and stop the writer, at exit
+def close(log):
+    thread = log['thread']
+    if thread is not None and thread.is_alive():
+        log['queue'].put(None)
+        thread.join(timeout=5)
+
+# Helper function run by the writer thread: waits for an entry, gathers whatever else
+# arrives within FLUSH_INTERVAL of it (up to BATCH_SIZE) and appends the batch in one
+# write. A None entry writes what is left and stops the thread.
+def _write_batches(log, entries):
+    running = True
+    while running:
+        batch = [entries.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        try:
+            while len(batch) < BATCH_SIZE:
+                batch.append(entries.get(timeout=max(0.0, deadline - time.monotonic())))
+        except queue.Empty:
+            pass
+        if None in batch:
+            running = False
+            batch = [line for line in batch if line is not None]
+        if batch:
+            try:
+                _append(log, ''.join(batch))
+                log['counts']['written'] += len(batch)
+            except OSError:
+                log['counts']['dropped'] += len(batch)
+
+# Helper function to append text to the log, rotating the file first if the text would
+# take it past max_bytes. The lock is held across both, against the other processes.
+def _append(log, text):
+    path = log['path']
+    data = text.encode('utf-8')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.lock', 'ab') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size and size + len(data) > log['max_bytes']:
+            for index in range(log['backups'] - 1, 0, -1):
+                if os.path.exists(f'{path}.{index}'):
+                    os.replace(f'{path}.{index}', f'{path}.{index + 1}')
+            if log['backups']:
+                os.replace(path, f'{path}.1')
+            else:
+                os.remove(path)
+        with open(path, 'ab') as log_file:
+            log_file.write(data)
+
+# Function to report the log's counters for monitoring
+def snapshot(log):
+    return {'audit_written': log['counts']['written'], 'audit_dropped': log['counts']['dropped'],
+            'audit_queued': log['queue'].qsize()}
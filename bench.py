@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from planner import SCHEDULING_MODES, SPORT_PROFILES, generate_game_plan, generate_line_plan
+
+# Benchmarks for the planners: python bench.py
+# Each case is timed as the best of a few runs and reported per segment, so growth with
+# the number of segments shows up directly.
+REPEATS = 5
+
+# Scripts run in a fresh interpreter import the project modules from here
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Import-time budgets in milliseconds, measured in a fresh interpreter. The scheduling core
+# must stay free of web dependencies so the CLI and batch workers start quickly.
+IMPORT_BUDGETS_MS = {'planner': 50, 'cli': 150}
+
+# Helper function to build a roster of `count` players who all play outfield, with the
+# first `keepers` able to go in goal
+def make_roster(count, keepers=2):
+    return [
+        {'name': f'Player {index + 1}',
+         'positions': ['defense', 'mid', 'forward'] + (['goal'] if index < keepers else []),
+         'rating': index % 5 + 1}
+        for index in range(count)
+    ]
+
+# Helper function to time a call, best of REPEATS, in milliseconds
+def best_of(call):
+    best = None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        call()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Function to print one result line
+def report(name, segments, ms):
+    print(f'{name:<40} {segments:>6} segments {ms:>9.2f} ms {ms * 1000 / segments:>8.1f} us/segment')
+
+# Football plans: a typical match in every mode, then long matches with many segments
+def bench_football():
+    roster = make_roster(12)
+    for mode in SCHEDULING_MODES:
+        stats = {}
+        ms = best_of(lambda: generate_game_plan(60, 5, '7_a_side', roster, mode=mode, stats=stats))
+        report(f'football 7-a-side {mode}', 12, ms)
+    for segments in (100, 500):
+        ms = best_of(lambda: generate_game_plan(segments, 1, '7_a_side', roster))
+        report('football 7-a-side greedy', segments, ms)
+
+# Line-change plans from 500 segments up, for every sport profile
+def bench_lines():
+    roster = make_roster(18, keepers=1)
+    for sport in SPORT_PROFILES:
+        for segments in (500, 1000, 2000):
+            ms = best_of(lambda: generate_line_plan(60, 60 / segments, sport, roster))
+            report(f'{sport} line changes', segments, ms)
+
+# Import times for the core, the CLI and the web app, each in a fresh interpreter, best of
+# REPEATS, against IMPORT_BUDGETS_MS. Returns the modules over budget.
+def bench_imports():
+    over_budget = []
+    for module in ('planner', 'cli', 'app'):
+        script = f'import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)'
+        ms = min(float(subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, cwd=HERE,
+                                      check=True).stdout) * 1000 for _ in range(REPEATS))
+        budget = IMPORT_BUDGETS_MS.get(module)
+        verdict = '' if budget is None else f'budget {budget} ms, ' + ('ok' if ms <= budget else 'OVER')
+        print(f'import {module:<33} {ms:>25.2f} ms {verdict}')
+        if budget is not None and ms > budget:
+            over_budget.append(module)
+    return over_budget
+
+# Script for bench_templates, run in a fresh interpreter: renders a 12-segment plan page
+# once (compiling the template, or loading it from the bytecode cache in argv[1]) and then
+# REPEATS more times, and prints both times in milliseconds
+TEMPLATE_SCRIPT = """
+import sys, time
+from app import create_app
+from bench import REPEATS, make_roster
+from flask import render_template
+from planner import generate_game_plan
+
+app = create_app({'TEMPLATE_CACHE_DIR': sys.argv[1] or None})
+game_plan, summary = generate_game_plan(60, 5, '7_a_side', make_roster(12))
+with app.test_request_context():
+    times = []
+    for _ in range(REPEATS + 1):
+        started = time.perf_counter()
+        render_template('game_plan.html', game_plan=game_plan, summary=summary, sub_time=5, stats={})
+        times.append((time.perf_counter() - started) * 1000)
+print(times[0], min(times[1:]))
+"""
+
+# Plan page render times in a new process: without the bytecode cache, with an empty one
+# (first start) and with the one that start left behind (restarts and new workers)
+def bench_templates():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, argument in (('no bytecode cache', ''), ('empty bytecode cache', cache_dir),
+                               ('filled bytecode cache', cache_dir)):
+            output = subprocess.run([sys.executable, '-c', TEMPLATE_SCRIPT, argument], capture_output=True, text=True,
+                                    cwd=HERE, check=True).stdout
+            first, steady = (float(value) for value in output.split())
+            print(f'render game_plan.html, {name:<22} first {first:>8.2f} ms, then {steady:>6.2f} ms')
+
+# Long plan page: the first render fills the segment fragment cache, repeat renders of the
+# same plan reuse it
+def bench_long_page():
+    from app import create_app
+    from flask import render_template
+
+    game_plan, summary = generate_game_plan(500, 1, '7_a_side', make_roster(12))
+    app = create_app()
+    with app.test_request_context():
+        render = lambda: render_template('game_plan.html', game_plan=game_plan, summary=summary, sub_time=1, stats={})
+        started = time.perf_counter()
+        render()
+        first = (time.perf_counter() - started) * 1000
+        print(f'render 500-segment plan page               first {first:>8.2f} ms, then {best_of(render):>6.2f} ms')
+
+if __name__ == '__main__':
+    over_budget = bench_imports()
+    bench_templates()
+    bench_long_page()
+    bench_football()
+    bench_lines()
+    if over_budget:
+        sys.exit(f"Over the import-time budget: {', '.join(over_budget)}")
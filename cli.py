@@ -0,0 +1,179 @@
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+
+import click
+
+from planner import (FIXTURE_DEFAULTS, GAME_TYPES, GOAL_BLOCKS, POSITION_LABELS, SCHEDULING_MODES, SPORT_PROFILES,
+                     parse_quotas, plan_fixture)
+
+# Command-line bulk planner: python cli.py ROSTERS [-o OUTPUT]
+#
+# Rosters come as JSON Lines, one fixture per line:
+#   {"fixture": "U10 v Reds", "minutes": 40, "game_type": "7_a_side", "players": [{"name": "Sam", ...}]}
+# or as CSV, one player per row, with the rows for each fixture together:
+#   fixture,name,positions,rating,arrives,leaves,stamina,quotas
+# Positions are separated by spaces or semicolons. In CSV, any of the columns minutes,
+# game_type, sub_time, mode or sport are read from a fixture's first row. Anything a
+# fixture leaves out comes from the command-line options.
+
+# Fixture settings that can come from the roster file, and how to read them from CSV
+FIXTURE_FIELDS = {'minutes': int, 'game_type': str, 'sub_time': float, 'mode': str, 'sport': str}
+
+# Helper function to read one player from a CSV row
+def read_player(row, index):
+    positions = (row.get('positions') or '').replace(';', ' ').split()
+    player = {'name': row.get('name') or f'Player {index}',
+              'positions': positions or ['defense', 'mid', 'forward', 'goal']}
+    if row.get('rating'):
+        player['rating'] = float(row['rating'])
+    if row.get('stamina'):
+        player['stamina'] = float(row['stamina'])
+    if row.get('quotas'):
+        player['quotas'] = parse_quotas(row['quotas'])
+    if row.get('arrives') or row.get('leaves'):
+        player['available'] = (float(row.get('arrives') or 0), float(row.get('leaves') or 'inf'))
+    return player
+
+# Generator of fixtures from a roster file, read one fixture at a time. A fixture that
+# cannot be read comes out as its name and the error, like one that cannot be planned.
+def read_fixtures(path):
+    with open(path, newline='', encoding='utf-8') as roster_file:
+        if path.endswith('.csv'):
+            rows = csv.DictReader(roster_file)
+            for index, (name, group) in enumerate(itertools.groupby(rows, key=lambda row: row.get('fixture')), start=1):
+                fixture = {'fixture': name or f'Fixture {index}'}
+                try:
+                    group = list(group)
+                    for field, convert in FIXTURE_FIELDS.items():
+                        if group[0].get(field):
+                            fixture[field] = convert(group[0][field])
+                    fixture['players'] = [read_player(row, number) for number, row in enumerate(group, start=1)]
+                except ValueError as error:
+                    fixture = {'fixture': fixture['fixture'], 'error': str(error)}
+                yield fixture
+        else:
+            for index, line in enumerate(roster_file, start=1):
+                if line.strip():
+                    try:
+                        fixture = json.loads(line)
+                    except ValueError as error:
+                        fixture = {'error': f'Line {index} is not valid JSON: {error}'}
+                    if not isinstance(fixture, dict):
+                        fixture = {'error': f'Line {index} is not a JSON object'}
+                    fixture.setdefault('fixture', f'Fixture {index}')
+                    yield fixture
+
+# Function to plan one fixture, or pass on the error of one that could not be read
+def plan_or_report(fixture):
+    if 'error' in fixture:
+        return {'fixture': fixture['fixture'], 'error': fixture['error']}
+    return plan_fixture(fixture)
+
+# Generator of plans in fixture order. With more than one worker, fixtures are planned in
+# a process pool that is kept at most two fixtures per worker ahead of the output.
+def plan_all(fixtures, workers):
+    if workers == 1:
+        for fixture in fixtures:
+            yield plan_or_report(fixture)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for fixture in fixtures:
+            pending.append(pool.submit(plan_or_report, fixture))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Writers: each consumes the plans as they come and writes them straight out. JSON Lines
+# has one plan (or error) per fixture.
+def write_jsonl(plans, out):
+    for plan in plans:
+        out.write(json.dumps(plan) + '\n')
+
+# CSV has one row per fixture and segment, a column per position, and names joined by
+# semicolons
+def write_csv(plans, out):
+    positions = [position for position in POSITION_LABELS if position != 'goal']
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(['fixture', 'time', 'goal'] + positions + ['subs', 'unavailable', 'error'])
+    for plan in plans:
+        if 'error' in plan:
+            writer.writerow([plan['fixture']] + [''] * (len(positions) + 4) + [plan['error']])
+            continue
+        for segment in plan['game_plan']:
+            writer.writerow([plan['fixture'], segment['time'], segment['positions'].get('goal') or '']
+                            + [';'.join(segment['positions'].get(position, [])) for position in positions]
+                            + [';'.join(segment['subs']), ';'.join(segment['unavailable']), ''])
+
+# HTML streams the plan page template with every fixture as one match; fixtures that
+# could not be planned are reported on stderr instead. Flask is only imported for this.
+def write_html(plans, out):
+    from app import app
+
+    def matches():
+        for index, plan in enumerate(plans, start=1):
+            if 'error' in plan:
+                click.echo(f"{plan['fixture']}: {plan['error']}", err=True)
+                continue
+            yield {'title': plan['fixture'], 'prefix': f'{index}_', 'game_plan': plan['game_plan'],
+                   'summary': plan['summary'], 'sub_time': plan['sub_time'], 'stats': plan['stats']}
+
+    for chunk in app.jinja_env.get_template('game_plan.html').generate(matches=matches()):
+        out.write(chunk)
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv, 'html': write_html}
+
+@click.command()
+@click.argument('rosters', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', default='-', type=click.Path(dir_okay=False, allow_dash=True),
+              help='File to write, or - for standard output.')
+@click.option('--format', 'output_format', type=click.Choice(sorted(WRITERS)),
+              help='Output format; defaults to the output file extension, then jsonl.')
+@click.option('--minutes', default=FIXTURE_DEFAULTS['minutes'], show_default=True,
+              help='Match length for fixtures without one.')
+@click.option('--game-type', default=FIXTURE_DEFAULTS['game_type'], show_default=True,
+              type=click.Choice(list(GAME_TYPES)))
+@click.option('--mode', default=FIXTURE_DEFAULTS['mode'], show_default=True, type=click.Choice(SCHEDULING_MODES))
+@click.option('--sport', default=FIXTURE_DEFAULTS['sport'], show_default=True,
+              type=click.Choice(['football'] + list(SPORT_PROFILES)))
+@click.option('--goal-blocks', default=FIXTURE_DEFAULTS['goal_blocks'], show_default=True,
+              type=click.Choice(list(GOAL_BLOCKS)))
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, type=click.IntRange(min=1),
+              help='Processes planning fixtures at once.')
+def main(rosters, output, output_format, minutes, game_type, mode, sport, goal_blocks, workers):
+    """Plan every fixture in ROSTERS (CSV or JSON Lines) and stream the plans out."""
+    output_format = output_format or os.path.splitext(output)[1].lstrip('.').lower()
+    if output_format not in WRITERS:
+        output_format = 'jsonl'
+    defaults = {'minutes': minutes, 'game_type': game_type, 'mode': mode, 'sport': sport, 'goal_blocks': goal_blocks}
+
+    counts = {'planned': 0, 'failed': 0}
+
+    def counted(plans):
+        for plan in plans:
+            counts['failed' if 'error' in plan else 'planned'] += 1
+            yield plan
+
+    started = time.perf_counter()
+    fixtures = ({**defaults, **fixture} for fixture in read_fixtures(rosters))
+    plans = counted(plan_all(fixtures, workers))
+    if output == '-':
+        WRITERS[output_format](plans, sys.stdout)
+    else:
+        with open(output, 'w', newline='', encoding='utf-8') as out:
+            WRITERS[output_format](plans, out)
+
+    click.echo(f"Planned {counts['planned']} fixtures ({counts['failed']} failed) in "
+               f"{time.perf_counter() - started:.1f}s with {workers} workers", err=True)
+    if counts['failed']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import gc
+import os
+import time
+
+# Production serving profile: gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master (preload_app) and warmed up there: templates are
+# compiled (loaded from the bytecode cache when an earlier start filled it) and a small
+# plan is rendered for every game type, so formation tables and code paths are loaded
+# before forking. Everything that survives is then frozen out of the garbage collector so
+# workers share those pages copy-on-write instead of touching them.
+# Each worker logs its memory and how long after the fork it was ready to serve.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+preload_app = True
+
+# Planning is CPU bound, so one worker per core (WEB_CONCURRENCY overrides, as on Heroku),
+# with a couple of threads each to overlap rendering and the ledger's disk writes
+workers = int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1)
+threads = int(os.environ.get('GUNICORN_THREADS') or 2)
+
+# Helper function to read this process's memory in MB: resident, and the part not shared
+# with the master
+def memory_mb():
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                field, _, value = line.partition(':')
+                if field in ('Rss', 'Private_Clean', 'Private_Dirty'):
+                    usage[field] = int(value.split()[0]) / 1024
+    except OSError:
+        return None
+    return usage.get('Rss', 0), usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0)
+
+# Function to warm the preloaded app: compile the templates and render the form and one
+# small plan per game type through the test client. The warm-up requests are kept out of
+# the audit log and the admission counters.
+def warm_up(server):
+    import admission
+    from app import app, precompile_templates
+    from planner import GAME_TYPES
+
+    started = time.perf_counter()
+    precompile_templates(app)
+    client = app.test_client()
+    audit_log, app.extensions['audit_log'] = app.extensions['audit_log'], None
+    try:
+        client.get('/')
+        for game_type in GAME_TYPES:
+            players = int(game_type.split('_')[0]) + 2
+            client.post('/submit', data={'minutes': '40', 'game_type': game_type, 'players': str(players)})
+    finally:
+        app.extensions['audit_log'] = audit_log
+    admission.reset_counts(app.extensions['plan_gate'])
+    admission.reset_counts(app.extensions['plan_flights'])
+    server.log.info('Warmed up in %.0f ms', (time.perf_counter() - started) * 1000)
+
+# Hooks: warm up and freeze in the master once it is ready to fork, then report from each
+# worker once it is running
+def when_ready(server):
+    warm_up(server)
+    gc.collect()
+    gc.freeze()
+    server.log.info('Froze %d objects before forking %d workers x %d threads', gc.get_freeze_count(), workers,
+                    threads)
+
+def pre_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+def post_worker_init(worker):
+    ready_ms = (time.perf_counter() - worker.forked_at) * 1000
+    memory = memory_mb()
+    if memory:
+        worker.log.info('Worker %s ready %.0f ms after fork, %.1f MB resident (%.1f MB private)', worker.pid,
+                        ready_ms, *memory)
+    else:
+        worker.log.info('Worker %s ready %.0f ms after fork', worker.pid, ready_ms)
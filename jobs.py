@@ -0,0 +1,177 @@
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from planner import FIXTURE_DEFAULTS, plan_fixture
+
+# Background jobs for plans too big for one request: a batch of fixtures (a season, or
+# several teams) planned on a small thread pool. Every job is a row in a SQLite table that
+# any web worker can read, so status, results and cancellation work whichever worker
+# handles the request. The job's thread checks its row between fixtures, records its
+# progress there and stores the finished plans for later retrieval. Each row names the
+# runner and process that queued it; jobs left unfinished by a process that has died
+# (a deploy, a restart or a killed worker) are marked failed when the next runner starts.
+# The table is a SQLite file, so the workers sharing it are on one host.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    fixtures TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    owner_pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+'''
+
+# Final job states; a job can be cancelled until it reaches one
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+# Seconds jobs and their results are kept after they finish, or after they were queued
+# for jobs that never finish
+JOB_RETENTION = 7 * 24 * 3600
+
+# Function to open the job table, creating it on first use. WAL lets status polls read
+# while a job thread writes its progress.
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+# Function to build a job runner for the database at `path`; its pool of `workers`
+# threads is only started by the first job, so a preloading server can fork safely.
+# Starting a runner prunes old jobs and fails the jobs orphaned by processes that are gone.
+def make_runner(path, workers):
+    runner = {'id': uuid.uuid4().hex, 'path': path, 'workers': workers, 'pool': None, 'lock': threading.Lock()}
+    conn = connect(path)
+    try:
+        _prune(conn)
+        fail_orphans(conn, runner)
+    finally:
+        conn.close()
+    return runner
+
+# Helper function to delete the jobs queued or finished more than JOB_RETENTION ago
+def _prune(conn):
+    cutoff = time.time() - JOB_RETENTION
+    with conn:
+        conn.execute('DELETE FROM jobs WHERE finished < ? OR (finished IS NULL AND created < ?)', (cutoff, cutoff))
+
+# Helper function to check whether a process is still running
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Function to mark failed the unfinished jobs whose process has died: its pid is gone, or
+# is now this process under another runner (the pid was reused after a restart). Returns
+# how many jobs were failed.
+def fail_orphans(conn, runner):
+    pid = os.getpid()
+    rows = conn.execute(f'SELECT id, owner, owner_pid FROM jobs WHERE status NOT IN {FINISHED_STATUSES}').fetchall()
+    orphans = [row['id'] for row in rows
+               if (row['owner'], row['owner_pid']) != (runner['id'], pid)
+               and (row['owner_pid'] is None or row['owner_pid'] == pid or not _alive(row['owner_pid']))]
+    with conn:
+        conn.executemany(
+            f"UPDATE jobs SET status = 'failed', error = ?, finished = ? "
+            f"WHERE id = ? AND status NOT IN {FINISHED_STATUSES}",
+            [('The worker planning this job stopped before it finished', time.time(), job_id) for job_id in orphans])
+    return len(orphans)
+
+# Function to queue a job planning `fixtures` (dicts as the bulk CLI reads them, with
+# FIXTURE_DEFAULTS for anything left out). Old jobs are pruned first. Returns the new
+# job's id.
+def submit(runner, fixtures):
+    fixtures = [{**FIXTURE_DEFAULTS, 'fixture': f'Fixture {index}', **fixture}
+                for index, fixture in enumerate(fixtures, start=1)]
+    job_id = uuid.uuid4().hex
+    conn = connect(runner['path'])
+    try:
+        _prune(conn)
+        with conn:
+            conn.execute('''INSERT INTO jobs (id, status, total, fixtures, created, owner, owner_pid)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         (job_id, 'queued', len(fixtures), json.dumps(fixtures), time.time(), runner['id'],
+                          os.getpid()))
+    finally:
+        conn.close()
+    with runner['lock']:
+        if runner['pool'] is None:
+            runner['pool'] = concurrent.futures.ThreadPoolExecutor(runner['workers'], thread_name_prefix='plan-job')
+    runner['pool'].submit(_run, runner['path'], job_id)
+    return job_id
+
+# Helper function to run one job in a pool thread. The row is only updated while the job
+# is still its own (not cancelled), and any unexpected error fails the job.
+def _run(path, job_id):
+    conn = connect(path)
+    try:
+        with conn:
+            claimed = conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'",
+                                   (time.time(), job_id)).rowcount
+        if not claimed:
+            return
+        fixtures = json.loads(conn.execute('SELECT fixtures FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+        plans = []
+        for fixture in fixtures:
+            plans.append(plan_fixture(fixture))
+            with conn:
+                still_running = conn.execute(
+                    "UPDATE jobs SET done = done + 1, failed = failed + ? WHERE id = ? AND status = 'running'",
+                    (int('error' in plans[-1]), job_id)).rowcount
+            if not still_running:
+                return
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished = ? WHERE id = ? AND status = 'running'",
+                (json.dumps(plans), time.time(), job_id))
+    except Exception as error:
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ? AND status = 'running'",
+                (str(error) or repr(error), time.time(), job_id))
+    finally:
+        conn.close()
+
+# Function to look up a job's status and progress, or None if there is no such job
+def status(conn, job_id):
+    row = conn.execute(
+        'SELECT id, status, total, done, failed, error, created, started, finished FROM jobs WHERE id = ?', (job_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job['progress'] = round(job['done'] / job['total'], 3) if job['total'] else 1.0
+    return job
+
+# Function to fetch a finished job's plans, one per fixture in order (a fixture that
+# could not be planned has an error instead), or None until the job is done
+def result(conn, job_id):
+    row = conn.execute("SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+    return json.loads(row['result']) if row else None
+
+# Function to cancel a queued or running job. A running job stops after the fixture it
+# is planning. Returns whether the job was cancelled.
+def cancel(conn, job_id):
+    with conn:
+        return conn.execute(
+            f"UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status NOT IN {FINISHED_STATUSES}",
+            (time.time(), job_id)).rowcount > 0
@@ -0,0 +1,128 @@
+import sqlite3
+
+# Season fairness ledger: minutes on the pitch, on the bench and in goal for every
+# player in every match, plus running season totals kept up to date as matches are
+# recorded. Both tables are keyed (and so indexed) by team first, which keeps the
+# per-player and per-team rollups to a single index lookup.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS appearances (
+    team TEXT NOT NULL,
+    match TEXT NOT NULL,
+    player TEXT NOT NULL,
+    minutes_on REAL NOT NULL,
+    minutes_bench REAL NOT NULL,
+    minutes_goal REAL NOT NULL,
+    PRIMARY KEY (team, match, player)
+);
+CREATE TABLE IF NOT EXISTS season_totals (
+    team TEXT NOT NULL,
+    player TEXT NOT NULL,
+    matches INTEGER NOT NULL,
+    minutes_on REAL NOT NULL,
+    minutes_bench REAL NOT NULL,
+    minutes_goal REAL NOT NULL,
+    PRIMARY KEY (team, player)
+);
+CREATE TABLE IF NOT EXISTS pairings (
+    team TEXT NOT NULL,
+    match TEXT NOT NULL,
+    player_a TEXT NOT NULL,
+    player_b TEXT NOT NULL,
+    segments INTEGER NOT NULL,
+    PRIMARY KEY (team, match, player_a, player_b)
+);
+'''
+
+# Function to open the ledger, creating the tables on first use
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+# Helper function to add (sign=1) or remove (sign=-1) appearances from the season totals
+def _apply_to_totals(conn, team, rows, sign):
+    conn.executemany(
+        '''INSERT INTO season_totals (team, player, matches, minutes_on, minutes_bench, minutes_goal)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (team, player) DO UPDATE SET
+               matches = matches + excluded.matches,
+               minutes_on = minutes_on + excluded.minutes_on,
+               minutes_bench = minutes_bench + excluded.minutes_bench,
+               minutes_goal = minutes_goal + excluded.minutes_goal''',
+        [(team, row['player'], sign, sign * row['minutes_on'], sign * row['minutes_bench'], sign * row['minutes_goal'])
+         for row in rows]
+    )
+
+# Function to record one match from a game plan summary, and optionally the segments
+# each pair of players shared (keyed by the pair's names in sorted order). Recording the
+# same match again replaces it, and only the players in that match have their totals touched.
+def record_match(conn, team, match, summary, pairings=None):
+    rows = [
+        {
+            'player': player,
+            'minutes_on': details['mins_field'],
+            'minutes_bench': details['mins_off'],
+            'minutes_goal': details['mins_goal'],
+        } for player, details in summary.items()
+    ]
+    with conn:
+        previous = conn.execute('SELECT * FROM appearances WHERE team = ? AND match = ?', (team, match)).fetchall()
+        _apply_to_totals(conn, team, previous, -1)
+        conn.execute('DELETE FROM appearances WHERE team = ? AND match = ?', (team, match))
+        conn.executemany(
+            '''INSERT INTO appearances (team, match, player, minutes_on, minutes_bench, minutes_goal)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            [(team, match, row['player'], row['minutes_on'], row['minutes_bench'], row['minutes_goal']) for row in rows]
+        )
+        _apply_to_totals(conn, team, rows, 1)
+        conn.execute('DELETE FROM season_totals WHERE team = ? AND matches <= 0', (team,))
+        conn.execute('DELETE FROM pairings WHERE team = ? AND match = ?', (team, match))
+        conn.executemany(
+            'INSERT INTO pairings (team, match, player_a, player_b, segments) VALUES (?, ?, ?, ?, ?)',
+            [(team, match, first, second, segments) for (first, second), segments in (pairings or {}).items()]
+        )
+
+# Function to look up season totals for one player, or None if they have no matches yet
+def player_totals(conn, team, player):
+    row = conn.execute('SELECT * FROM season_totals WHERE team = ? AND player = ?', (team, player)).fetchone()
+    return dict(row) if row else None
+
+# Function to roll up a team's season: totals per player, ordered by name
+def team_rollup(conn, team):
+    rows = conn.execute('SELECT * FROM season_totals WHERE team = ? ORDER BY player', (team,)).fetchall()
+    return [dict(row) for row in rows]
+
+# Function to turn season totals into carry-over priorities for the engine: the share of
+# each player's time at matches spent on the pitch (outfield or in goal). Players with
+# no history are left out. The `matches` being planned again are left out of the totals,
+# so re-planning them starts from the same priorities as the first time.
+def carry_over(conn, team, players, matches=()):
+    matches = list(matches)
+    replaced = conn.execute(
+        f'''SELECT player, SUM(minutes_on) AS minutes_on, SUM(minutes_bench) AS minutes_bench,
+                   SUM(minutes_goal) AS minutes_goal FROM appearances
+            WHERE team = ? AND match IN ({', '.join('?' * len(matches))}) GROUP BY player''', (team, *matches)
+    ).fetchall()
+    replaced = {row['player']: row for row in replaced}
+    shares = {}
+    for row in team_rollup(conn, team):
+        previous = replaced.get(row['player'], {'minutes_on': 0, 'minutes_bench': 0, 'minutes_goal': 0})
+        on = row['minutes_on'] + row['minutes_goal'] - previous['minutes_on'] - previous['minutes_goal']
+        attended = on + row['minutes_bench'] - previous['minutes_bench']
+        if row['player'] in players and attended > 0:
+            # Rounded so float drift in the running totals cannot reorder tied players
+            shares[row['player']] = round(on / attended, 6)
+    return shares
+
+# Function to total the segments each pair of these players has shared this season,
+# keyed by the pair's names in sorted order, leaving out the `matches` being planned again
+def pair_history(conn, team, players, matches=()):
+    matches = list(matches)
+    rows = conn.execute(
+        f'''SELECT player_a, player_b, SUM(segments) AS segments FROM pairings
+            WHERE team = ? AND match NOT IN ({', '.join('?' * len(matches))}) GROUP BY player_a, player_b''',
+        (team, *matches)
+    ).fetchall()
+    return {(row['player_a'], row['player_b']): row['segments'] for row in rows
+            if row['player_a'] in players and row['player_b'] in players}
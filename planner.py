@@ -0,0 +1,1568 @@
+import bisect
+import copy
+import itertools
+import math
+import time
+
+# Scheduling core: substitution times, formations and every planner. Pure Python with no
+# web dependencies, so the CLI, benchmarks and batch workers import it without Flask.
+
+# Function to calculate substitution time
+def calculate_sub_time(minutes, min_sub_time_input, num_players, num_goalkeepers):
+    outfield_players = num_players - num_goalkeepers
+    if not min_sub_time_input:
+        # Calculate a balanced sub time close to dividing playtime evenly among outfield players
+        ideal_sub_time = round(minutes / outfield_players, 1)  # Allow half-minute precision
+        return ideal_sub_time
+
+    min_sub_time = int(min_sub_time_input)
+    ideal_sub_time = minutes // outfield_players
+
+    # Return the greater of the user input and calculated ideal sub time
+    return max(min_sub_time, ideal_sub_time)
+
+# Helper function to conditionally format time
+def format_time(time_value):
+    return f"{time_value:.1f}".rstrip('0').rstrip('.')  # Remove trailing zeros and decimal point if whole
+
+
+# Outfield positions, in the order the engine fills them
+OUTFIELD_POSITIONS = ('defense', 'mid', 'forward')
+
+# Default shape for each game type, written defense-mid-forward (the keeper is implied)
+GAME_TYPES = {
+    '4_a_side': '1-1-1',
+    '5_a_side': '2-1-1',
+    '6_a_side': '2-2-1',
+    '7_a_side': '2-3-1',
+    '8_a_side': '3-3-1',
+    '9_a_side': '3-2-3',
+    '10_a_side': '3-4-2',
+    '11_a_side': '4-4-2',
+}
+
+# Helper function to build one formation entry with its precomputed slot vector
+def build_formation(defense, mid, forward):
+    outfield_slots = ('defense',) * defense + ('mid',) * mid + ('forward',) * forward
+    return {
+        'name': f'{defense}-{mid}-{forward}',
+        'players': 1 + len(outfield_slots),
+        'counts': {'goal': 1, 'defense': defense, 'mid': mid, 'forward': forward},
+        'outfield_slots': outfield_slots,
+    }
+
+# Formation registry, built once at import: every defense-mid-forward shape for
+# 4- through 11-a-side, keyed by name (e.g. "2-3-1")
+FORMATIONS = {
+    formation['name']: formation
+    for outfield in range(3, 11)
+    for defense in range(1, outfield - 1)
+    for mid in range(1, outfield - defense)
+    for formation in [build_formation(defense, mid, outfield - defense - mid)]
+}
+
+# Helper function to look up the formation for each period of the match. `formation`
+# may be empty (use the game type's default), a name, or a list of names, one per period.
+def resolve_formations(game_type, formation=None):
+    if game_type not in GAME_TYPES:
+        raise ValueError(f"Unknown game type: {game_type}")
+    if not formation:
+        names = [GAME_TYPES[game_type]]
+    elif isinstance(formation, str):
+        names = [formation]
+    else:
+        names = list(formation)
+
+    formations = []
+    for name in names:
+        if name not in FORMATIONS:
+            raise ValueError(f"Unknown formation: {name}")
+        if FORMATIONS[name]['players'] != FORMATIONS[GAME_TYPES[game_type]]['players']:
+            raise ValueError(f"Formation {name} does not fit {game_type.replace('_', '-')}")
+        formations.append(FORMATIONS[name])
+    return formations
+
+# Scheduling modes: "greedy" fills each segment by playtime alone, "sticky" also
+# pays a cost for every substitution and position change at a stoppage, "balanced"
+# uses player ratings to keep every segment's strength close to the match average,
+# "diverse" steers towards players who have shared the pitch least
+SCHEDULING_MODES = ('greedy', 'sticky', 'balanced', 'diverse')
+
+# Balanced and diverse modes only choose between players within this many segments of
+# playtime of the player who has played least, so minutes stay fair
+BALANCE_PLAYTIME_SLACK = 0.5
+
+# Weight of a segment shared in an earlier match against one shared in this match
+PAIR_HISTORY_WEIGHT = 0.5
+
+# Sticky mode costs, in segments of playtime. A player coming off or going on costs
+# half a segment (so a swap costs one), as does moving between defense/mid/forward.
+STICKY_SUB_COST = 0.5
+STICKY_POSITION_COST = 0.5
+
+# Cost of putting a player into a position they did not tick
+OUT_OF_POSITION_COST = 1000.0
+
+# Helper function to find the cheapest assignment of rows to columns (Hungarian
+# algorithm, rows <= columns). Returns the column chosen for each row.
+def min_cost_assignment(cost):
+    num_rows = len(cost)
+    num_cols = len(cost[0]) if cost else 0
+    row_potential = [0.0] * (num_rows + 1)
+    col_potential = [0.0] * (num_cols + 1)
+    col_owner = [0] * (num_cols + 1)
+    way = [0] * (num_cols + 1)
+
+    for row in range(1, num_rows + 1):
+        col_owner[0] = row
+        current_col = 0
+        min_slack = [float('inf')] * (num_cols + 1)
+        used = [False] * (num_cols + 1)
+        while True:
+            used[current_col] = True
+            owner = col_owner[current_col]
+            delta = float('inf')
+            next_col = 0
+            for col in range(1, num_cols + 1):
+                if used[col]:
+                    continue
+                slack = cost[owner - 1][col - 1] - row_potential[owner] - col_potential[col]
+                if slack < min_slack[col]:
+                    min_slack[col] = slack
+                    way[col] = current_col
+                if min_slack[col] < delta:
+                    delta = min_slack[col]
+                    next_col = col
+            for col in range(num_cols + 1):
+                if used[col]:
+                    row_potential[col_owner[col]] += delta
+                    col_potential[col] -= delta
+                else:
+                    min_slack[col] -= delta
+            current_col = next_col
+            if col_owner[current_col] == 0:
+                break
+        while current_col:
+            previous_col = way[current_col]
+            col_owner[current_col] = col_owner[previous_col]
+            current_col = previous_col
+
+    assignment = [None] * num_rows
+    for col in range(1, num_cols + 1):
+        if col_owner[col]:
+            assignment[col_owner[col] - 1] = col - 1
+    return assignment
+
+# Helper function to list everyone on the pitch in a segment
+def segment_names(segment_plan):
+    names = [segment_plan['positions']['goal']] if segment_plan['positions']['goal'] else []
+    for position in OUTFIELD_POSITIONS:
+        names.extend(segment_plan['positions'][position])
+    return names
+
+# Helper function to count substitutions (players coming on) and the stoppages with any,
+# leaving out the segments in `free_windows` (period breaks) from the windows
+def count_substitutions(game_plan, free_windows=()):
+    subs = 0
+    windows = 0
+    for segment in range(1, len(game_plan)):
+        coming_on = len(set(segment_names(game_plan[segment])) - set(segment_names(game_plan[segment - 1])))
+        subs += coming_on
+        windows += coming_on > 0 and segment not in free_windows
+    return subs, windows
+
+# Helper function to count the segments each pair of players shared the pitch, keyed by
+# the pair's names in sorted order
+def count_pairings(game_plan):
+    pairings = {}
+    for segment_plan in game_plan:
+        for pair in itertools.combinations(sorted(segment_names(segment_plan)), 2):
+            pairings[pair] = pairings.get(pair, 0) + 1
+    return pairings
+
+# Helper function to count touchline moves: every player whose role (goal, a field
+# position or the bench) differs from the previous segment is one move at that stoppage
+def count_touchline_moves(game_plan):
+    moves = 0
+    previous_roles = None
+    for segment_plan in game_plan:
+        roles = {name: 'subs' for name in segment_plan['subs']}
+        if segment_plan['positions']['goal']:
+            roles[segment_plan['positions']['goal']] = 'goal'
+        for position in OUTFIELD_POSITIONS:
+            for name in segment_plan['positions'][position]:
+                roles[name] = position
+        if previous_roles is not None:
+            moves += sum(1 for name, role in roles.items() if previous_roles.get(name, role) != role)
+        previous_roles = roles
+    return moves
+
+# Rules the constraint layer understands, all optional:
+#   max_bench_streak - most segments in a row a player may sit out
+#   min_stint        - fewest minutes a player stays on once they go on
+#   min_minutes      - fewest minutes every player gets over the match
+CONSTRAINT_RULES = ('max_bench_streak', 'min_stint', 'min_minutes')
+
+# Search nodes the constraint layer may visit, and seconds it may run, before giving up
+CONSTRAINT_NODE_BUDGET = 20000
+CONSTRAINT_TIME_LIMIT = 2.0
+
+# Minutes of rounding error the constraint layer ignores when comparing minute totals
+MINUTE_TOLERANCE = 1e-6
+
+# Raised when the rules cannot all be met; `rule` names the one that breaks
+class PlanInfeasible(ValueError):
+    def __init__(self, rule, message):
+        super().__init__(message)
+        self.rule = rule
+
+# Helper function to check that a set of players can fill a formation's outfield slots
+# in their own positions (bipartite matching, augmenting paths)
+def can_fill_slots(players, slots):
+    slot_owner = [None] * len(slots)
+
+    def place(player, visited):
+        for index, position in enumerate(slots):
+            if index in visited or position not in player['positions']:
+                continue
+            visited.add(index)
+            if slot_owner[index] is None or place(slot_owner[index], visited):
+                slot_owner[index] = player
+                return True
+        return False
+
+    return all(place(player, set()) for player in players)
+
+# Helper function to list the distinct ways of choosing `count` of `items` when items
+# with the same key are interchangeable: one selection per number taken from each group of
+# equal items, the earliest items in each group first. Selections taking the most from
+# the earliest groups come first.
+def distinct_selections(items, count, key):
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    groups = list(groups.values())
+    room_after = [sum(len(group) for group in groups[index + 1:]) for index in range(len(groups))]
+
+    def select(index, count):
+        if count == 0:
+            yield []
+            return
+        if index == len(groups):
+            return
+        for taken in range(min(count, len(groups[index])), max(0, count - room_after[index]) - 1, -1):
+            for rest in select(index + 1, count - taken):
+                yield groups[index][:taken] + rest
+
+    return select(0, count)
+
+# Constraint layer: choose which outfield players are on the pitch in every segment so
+# that all the rules hold, preferring the players who have played least. Searches
+# segment by segment with propagation (players a rule forces on are placed first),
+# lookahead pruning and memoised dead ends. Returns one set of names per segment.
+# Players only count within their availability; minimum minutes scale with it. Playing
+# time and stints are kept in minutes, so segments of any length count for what they are,
+# and the goal minutes already planned for each keeper count towards their minimum from
+# the start. The search stops at CONSTRAINT_NODE_BUDGET nodes or CONSTRAINT_TIME_LIMIT
+# seconds, whichever comes first.
+def solve_lineups(players_data, segment_formations, segment_goalkeepers, segment_durations, rules, stats=None,
+                  segment_available=None, season_share=None):
+    num_segments = len(segment_formations)
+    names = [player['name'] for player in players_data]
+    by_name = {player['name']: player for player in players_data}
+    if segment_available is None:
+        segment_available = [set(names) for _ in range(num_segments)]
+    max_bench = rules.get('max_bench_streak')
+    min_stint = rules.get('min_stint') or 0
+    min_minutes = rules.get('min_minutes') or 0
+    match_minutes = sum(segment_durations)
+    pitch_places = [formation['players'] for formation in segment_formations]
+    # Minutes of outfield pitch time in every segment, and in all the segments after each one
+    place_minutes = [len(formation['outfield_slots']) * duration
+                     for formation, duration in zip(segment_formations, segment_durations)]
+    places_after = [sum(place_minutes[segment + 1:]) for segment in range(num_segments)]
+
+    # Minutes each player is still available for, and of those the minutes planned in goal
+    # and left for outfield, from every segment to the end
+    available_after = {name: [0.0] * (num_segments + 1) for name in names}
+    goal_after = {name: [0.0] * (num_segments + 1) for name in names}
+    outfield_after = {name: [0.0] * (num_segments + 1) for name in names}
+    for segment in range(num_segments - 1, -1, -1):
+        duration = segment_durations[segment]
+        for name in names:
+            available = name in segment_available[segment]
+            in_goal = name == segment_goalkeepers[segment]
+            available_after[name][segment] = round(available_after[name][segment + 1] + available * duration, 6)
+            goal_after[name][segment] = round(goal_after[name][segment + 1] + in_goal * duration, 6)
+            outfield_after[name][segment] = round(outfield_after[name][segment + 1]
+                                                  + (available and not in_goal) * duration, 6)
+    required = {name: min(available_after[name][0], min_minutes * available_after[name][0] / match_minutes)
+                for name in names}
+
+    # Outfield minutes a player still needs from a segment on, after the goal time planned
+    def still_needed(name, played, segment):
+        return required[name] - played - goal_after[name][segment]
+
+    # Minutes each player can stay on from every segment before full time or the end of
+    # their availability; a stint may only start where it can last the minimum stint
+    run_after = {name: [0.0] * (num_segments + 1) for name in names}
+    for segment in range(num_segments - 1, -1, -1):
+        for name in names:
+            run_after[name][segment] = (round(run_after[name][segment + 1] + segment_durations[segment], 6)
+                                        if name in segment_available[segment] else 0.0)
+
+    def can_start(name, segment):
+        return run_after[name][segment] >= min_stint - MINUTE_TOLERANCE
+
+    # Up-front checks that prove a rule impossible before any search
+    if min_minutes > match_minutes + MINUTE_TOLERANCE:
+        raise PlanInfeasible('min_minutes', f"Nobody can play {format_time(rules['min_minutes'])} minutes in a "
+                                            f"{format_time(match_minutes)} minute match")
+    if sum(max(0, still_needed(name, 0, 0)) for name in names) > sum(place_minutes) + MINUTE_TOLERANCE:
+        raise PlanInfeasible('min_minutes', f"{len(names)} players cannot all get {format_time(rules['min_minutes'])} minutes "
+                                            f"with {pitch_places[0]} places on the pitch")
+    if max_bench is not None:
+        for first in range(num_segments - max_bench):
+            window_segments = range(first, first + max_bench + 1)
+            present = set.intersection(*(set(segment_available[segment]) for segment in window_segments))
+            places = min(pitch_places[segment] for segment in window_segments)
+            if len(present) > (max_bench + 1) * places:
+                window = 'segment' if max_bench == 0 else f'{max_bench + 1} segments'
+                raise PlanInfeasible('max_bench_streak', f"{len(present)} players cannot all play in every {window} "
+                                                         f"with {places} places on the pitch")
+
+    # Per-player state: (minutes played, minutes into the current stint, current bench streak
+    # in segments). Outfield players with the same positions, availability and state are interchangeable,
+    # so branches and dead ends are keyed by kind rather than by name.
+    initial = {name: (0, 0, 0) for name in names}
+    keepers = set(segment_goalkeepers)
+    kind = {
+        name: ('keeper', name) if name in keepers else
+              ('player', tuple(sorted(by_name[name]['positions'])), tuple(available_after[name]))
+        for name in names
+    }
+    order = {name: index for index, name in enumerate(names)}
+    season_share = season_share or {}
+    blame = {rule: 0 for rule in CONSTRAINT_RULES}
+    dead_ends = set()
+    nodes = 0
+    deadline = time.perf_counter() + CONSTRAINT_TIME_LIMIT
+
+    def out_of_budget():
+        return nodes > CONSTRAINT_NODE_BUDGET or time.perf_counter() > deadline
+
+    def forced_on(state, segment):
+        forced = {}
+        for name in segment_available[segment]:
+            played, stint, bench = state[name]
+            if max_bench is not None and bench >= max_bench:
+                forced[name] = 'max_bench_streak'
+            elif 0 < stint < min_stint - MINUTE_TOLERANCE:
+                forced[name] = 'min_stint'
+            elif still_needed(name, played, segment) > outfield_after[name][segment + 1] + MINUTE_TOLERANCE:
+                forced[name] = 'min_minutes'
+        return forced
+
+    # Time away from the match neither extends a bench streak nor continues a stint
+    def advance(state, on_pitch, present, duration):
+        return {
+            name: ((round(played + duration, 6), round(stint + duration, 6), 0) if name in on_pitch else
+                   (played, 0, bench + 1) if name in present else (played, 0, bench))
+            for name, (played, stint, bench) in state.items()
+        }
+
+    def search(segment, state):
+        nonlocal nodes
+        if segment == num_segments:
+            return []
+        key = (segment, tuple(sorted((kind[name], state[name]) for name in names)))
+        if key in dead_ends:
+            return None
+        nodes += 1
+        if out_of_budget():
+            return None
+
+        goalkeeper = segment_goalkeepers[segment]
+        slots = segment_formations[segment]['outfield_slots']
+        forced = forced_on(state, segment)
+        forced.pop(goalkeeper, None)
+
+        # Propagation: players who can no longer reach the minimum make this branch dead
+        for name, (played, _, _) in state.items():
+            if still_needed(name, played, segment) > outfield_after[name][segment] + MINUTE_TOLERANCE:
+                blame['min_minutes'] += 1
+                dead_ends.add(key)
+                return None
+        if len(forced) > len(slots):
+            for rule in forced.values():
+                blame[rule] += 1
+            dead_ends.add(key)
+            return None
+        # Players who must go on here, in goal or forced outfield, cannot start a stint too
+        # short for the minimum
+        if any(state[name][1] == 0 and not can_start(name, segment) for name in [goalkeeper, *forced] if name):
+            blame['min_stint'] += 1
+            dead_ends.add(key)
+            return None
+
+        # Fill the rest of the slots with the players who have played least (counting goal
+        # time still to come) and waited longest, trying each distinct mix of players once
+        optional = sorted(
+            (name for name in segment_available[segment] if name not in forced and name != goalkeeper
+             and (state[name][1] > 0 or can_start(name, segment))),
+            key=lambda name: (state[name][0] + goal_after[name][segment], -state[name][2], season_share.get(name, 0),
+                              len(by_name[name]['positions']), order[name])
+        )
+        for extra in distinct_selections(optional, len(slots) - len(forced), lambda name: (kind[name], state[name])):
+            outfield = list(forced) + list(extra)
+            if not out_of_position and not can_fill_slots([by_name[name] for name in outfield], slots):
+                continue
+            on_pitch = set(outfield)
+            if goalkeeper:
+                on_pitch.add(goalkeeper)
+            next_state = advance(state, on_pitch, segment_available[segment], segment_durations[segment])
+
+            # Lookahead: the minutes still owed must fit in the places left, and the players
+            # forced on next segment must fit on the pitch
+            owed = sum(max(0, still_needed(name, played, segment + 1)) for name, (played, _, _) in next_state.items())
+            if owed > places_after[segment] + MINUTE_TOLERANCE:
+                blame['min_minutes'] += 1
+                continue
+            if segment + 1 < num_segments:
+                next_forced = forced_on(next_state, segment + 1)
+                if len(next_forced) > pitch_places[segment + 1]:
+                    for rule in next_forced.values():
+                        blame[rule] += 1
+                    continue
+            rest = search(segment + 1, next_state)
+            if rest is not None:
+                return [set(outfield)] + rest
+            if out_of_budget():
+                return None
+
+        dead_ends.add(key)
+        return None
+
+    # Look for a plan with everyone in their own positions first, then let the rules
+    # put players out of position if that is the only way to meet them
+    out_of_position = False
+    lineups = search(0, initial)
+    if lineups is None and not out_of_budget():
+        out_of_position = True
+        blame = {rule: 0 for rule in CONSTRAINT_RULES}
+        dead_ends.clear()
+        lineups = search(0, initial)
+    if stats is not None:
+        stats['constraint_nodes'] = nodes
+    if lineups is None:
+        # Blame the rule that cut off the most branches, naming any rule it clashed with
+        rule = max(blame, key=lambda rule: (blame[rule], rule in rules))
+        clashes = [other.replace('_', ' ') for other in CONSTRAINT_RULES if other != rule and blame[other]]
+        alongside = f" alongside {' and '.join(clashes)}" if clashes else ''
+        if out_of_budget():
+            raise PlanInfeasible(rule, f"No plan found that meets the {rule.replace('_', ' ')} rule{alongside} "
+                                       f"within the search budget")
+        raise PlanInfeasible(rule, f"The {rule.replace('_', ' ')} rule cannot be met{alongside} with this squad")
+    return lineups
+
+# Substitution rules for competitions that limit changes. `max_subs` is the most players
+# who may come on over the match and `max_windows` the most stoppages with substitutions
+# (None for no limit); without `re_entry` a player who comes off stays off.
+SUB_PROFILES = {
+    'rolling': {'max_subs': None, 'max_windows': None, 're_entry': True},
+    'league': {'max_subs': 5, 'max_windows': 3, 're_entry': False},
+    'cup': {'max_subs': 3, 'max_windows': 3, 're_entry': False},
+}
+
+# Search nodes the substitution search may visit before settling for its best plan so far
+SUB_SEARCH_NODE_BUDGET = 50000
+
+# Substitution-rule search: choose who is on the pitch in every segment so the plan stays
+# within the substitution rules, minimising the squared gap between each player's pitch
+# minutes and their fair share (in proportion to their availability). Stoppages in
+# `free_windows` (period breaks) do not count against the window limit. Branch and bound
+# over stoppages: at each one the branches are how many extra players to change, taking
+# off whoever is furthest ahead of their share and bringing on whoever is furthest
+# behind; a branch is pruned when even its best case (see `bound`) cannot beat the best
+# plan found. Keepers are fixed beforehand
+# and a keeper change counts as a substitution when someone comes on for it. Returns
+# one set of outfield names per segment.
+def solve_sub_rules(players_data, segment_formations, segment_goalkeepers, segment_available, segment_durations,
+                    sub_rules, stats=None, free_windows=()):
+    started = time.perf_counter()
+    num_segments = len(segment_formations)
+    max_subs = sub_rules.get('max_subs')
+    max_subs = math.inf if max_subs is None else max_subs
+    max_windows = sub_rules.get('max_windows')
+    max_windows = math.inf if max_windows is None else max_windows
+    re_entry = sub_rules.get('re_entry', True)
+    order = {player['name']: index for index, player in enumerate(players_data)}
+    outfield_capable = {player['name'] for player in players_data
+                        if any(position in player['positions'] for position in OUTFIELD_POSITIONS)}
+
+    # Fair share of pitch minutes, and minutes available from each segment to the end
+    places = [min(formation['players'], len(available))
+              for formation, available in zip(segment_formations, segment_available)]
+    available_from = [dict.fromkeys(order, 0.0) for _ in range(num_segments + 1)]
+    for segment in reversed(range(num_segments)):
+        for name in order:
+            available_from[segment][name] = (available_from[segment + 1][name]
+                                             + segment_durations[segment] * (name in segment_available[segment]))
+    total_available = sum(available_from[0].values())
+    # Keepers still to play in goal from each segment on; without re-entry they cannot come off first
+    keepers_from = [set(segment_goalkeepers[segment:]) - {None} for segment in range(num_segments + 1)]
+    pitch_minutes = sum(count * duration for count, duration in zip(places, segment_durations))
+    target = {name: pitch_minutes * available_from[0][name] / total_available for name in order}
+
+    # Best case from here. Players off the pitch stay on their current minutes, and players
+    # on it play every segment they are available for, except that each entry still
+    # allowed lets one player off the pitch come on and one on it come off at the best
+    # moment for them; only the largest of those gains are counted
+    def bound(segment, on_pitch, played, came_off, entries):
+        total = 0.0
+        gains_on = []
+        gains_off = []
+        for name in order:
+            now = played[name]
+            most = now + available_from[segment][name]
+            over = max(0.0, now - target[name]) ** 2
+            best_case = over + max(0.0, target[name] - most) ** 2
+            if name in on_pitch:
+                stay = max(0.0, most - target[name]) ** 2 + max(0.0, target[name] - most) ** 2
+                total += stay
+                if stay > best_case:
+                    gains_on.append(stay - best_case)
+            else:
+                stuck = over + max(0.0, target[name] - now) ** 2
+                total += stuck
+                if stuck > best_case and (re_entry or name not in came_off):
+                    gains_off.append(stuck - best_case)
+        if entries:
+            for gains in (gains_on, gains_off):
+                gains.sort(reverse=True)
+                total -= sum(gains[:entries] if entries < len(gains) else gains)
+        return total
+
+    best = [math.inf, None]
+    nodes = 0
+    pruned = 0
+
+    def search(segment, on_pitch, played, subs_used, windows_used, came_off, lineups):
+        nonlocal nodes, pruned
+        nodes += 1
+        if segment == num_segments:
+            score = sum((played[name] - target[name]) ** 2 for name in order)
+            if score < best[0]:
+                best[:] = [score, list(lineups)]
+            return
+        if nodes > SUB_SEARCH_NODE_BUDGET:
+            return
+
+        keeper = segment_goalkeepers[segment]
+        available = segment_available[segment]
+        outfield_size = places[segment] - (1 if keeper else 0)
+        ahead = lambda name: (played[name] - target[name], -order[name])
+        # Players who can stay on, most ahead of their share first and later keepers last
+        stays_on = set() if re_entry else keepers_from[segment + 1]
+        staying = sorted([name for name in on_pitch if name in available and name != keeper
+                          and name in outfield_capable], key=lambda name: (name not in stays_on, *ahead(name)),
+                         reverse=True)
+        # Players who can come on, furthest behind their share first
+        bench = [name for name in available if name not in on_pitch and name != keeper
+                 and (re_entry or name not in came_off)]
+        bench.sort(key=lambda name: (name not in outfield_capable, played[name] - target[name], order[name]))
+        forced_off = max(0, len(staying) - outfield_size)
+        staying = staying[forced_off:]
+        fill = min(len(bench), outfield_size - len(staying))
+        extra = 0 if segment == 0 else min(len(staying), len(bench) - fill)
+
+        children = []
+        for swaps in range(extra + 1):
+            lineup = set(staying[swaps:]) | set(bench[:fill + swaps])
+            new_on = lineup | ({keeper} if keeper else set())
+            subs = len(new_on - on_pitch) if segment else 0
+            window = subs > 0 and segment not in free_windows
+            if subs_used + subs > max_subs or windows_used + window > max_windows:
+                break
+            new_played = dict(played)
+            for name in new_on:
+                new_played[name] += segment_durations[segment]
+            new_came_off = came_off | (on_pitch - new_on)
+            if new_came_off & stays_on:
+                continue
+            entries = 0 if windows_used + window >= max_windows else max_subs - subs_used - subs
+            children.append((bound(segment + 1, new_on, new_played, new_came_off, entries), swaps, lineup, new_on,
+                             new_played, subs, window, new_came_off))
+
+        children.sort(key=lambda child: (child[0], child[1]))
+        for child_bound, _, lineup, new_on, new_played, subs, window, new_came_off in children:
+            if child_bound >= best[0]:
+                pruned += 1
+                continue
+            lineups.append(lineup)
+            search(segment + 1, new_on, new_played, subs_used + subs, windows_used + window, new_came_off, lineups)
+            lineups.pop()
+
+    search(0, set(), dict.fromkeys(order, 0), 0, 0, set(), [])
+    if stats is not None:
+        stats['sub_search'] = {
+            'nodes': nodes,
+            'pruned': pruned,
+            'complete': nodes <= SUB_SEARCH_NODE_BUDGET,
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+    if best[1] is None:
+        raise PlanInfeasible('sub_rules', "No plan keeps within the substitution rules with these players and keepers")
+    return best[1]
+
+# Helper function to read a roster entry's availability window in minutes. Entries
+# without one are there for the whole match.
+def availability_window(player, minutes):
+    start, end = player.get('available') or (0, minutes)
+    start, end = max(0, start), min(minutes, end)
+    if start >= end:
+        raise ValueError(f"{player['name']} is not available at any point in the match")
+    return start, end
+
+# Helper function to index availability by segment: one set of names per segment,
+# built in a single pass over the roster so each availability check is a set lookup.
+# A player is available for a segment when their window covers all of it.
+def index_availability(players_data, segment_bounds, minutes):
+    segment_starts = [start for start, _ in segment_bounds]
+    segment_ends = [end for _, end in segment_bounds]
+    segment_available = [set() for _ in segment_bounds]
+    for player in players_data:
+        start, end = availability_window(player, minutes)
+        first = bisect.bisect_left(segment_starts, start - 1e-9)
+        last = bisect.bisect_right(segment_ends, end + 1e-9)
+        for segment in range(first, last):
+            segment_available[segment].add(player['name'])
+    return segment_available
+
+# How often flexible goalkeepers change: the match splits into this many contiguous
+# goal blocks of about equal time ("segment" gives every segment its own block)
+GOAL_BLOCKS = {'match': 1, 'half': 2, 'quarter': 4, 'segment': None}
+
+# Goalkeeper planner, run once before outfield assignment: gives each goal block to one
+# keeper who is available for all of it, preferring dedicated keepers and then whoever
+# has the least goal time so far. Blocks no single keeper can cover are filled segment
+# by segment, keeping the same keeper while they are available. Returns one name (or
+# None) per segment. `goal_time` is updated in place with each keeper's goal minutes.
+def plan_goalkeepers(players_data, segment_available, segment_durations, goal_blocks='half', goal_time=None):
+    if goal_blocks not in GOAL_BLOCKS:
+        raise ValueError(f"Unknown goal blocks: {goal_blocks}")
+    num_segments = len(segment_available)
+    num_blocks = min(num_segments, GOAL_BLOCKS[goal_blocks] or num_segments)
+    keepers = [player for player in players_data if 'goal' in player['positions']]
+    if goal_time is None:
+        goal_time = {}
+    for player in keepers:
+        goal_time.setdefault(player['name'], 0)
+
+    def preference(player):
+        return (len(player['positions']) > 1, goal_time[player['name']], keepers.index(player))
+
+    # Each block starts at the last segment boundary at or before its share of the match
+    segment_starts = list(itertools.accumulate(segment_durations, initial=0))[:-1]
+    block_starts = [bisect.bisect_right(segment_starts, block * sum(segment_durations) / num_blocks + 1e-9) - 1
+                    for block in range(num_blocks)] + [num_segments]
+
+    segment_goalkeepers = [None] * num_segments
+    for block in range(num_blocks):
+        block_segments = range(block_starts[block], block_starts[block + 1])
+        whole_block = [p for p in keepers if all(p['name'] in segment_available[s] for s in block_segments)]
+        current = min(whole_block, key=preference)['name'] if whole_block else None
+        for segment in block_segments:
+            if current not in segment_available[segment]:
+                available = [p for p in keepers if p['name'] in segment_available[segment]]
+                current = min(available, key=preference)['name'] if available else None
+            segment_goalkeepers[segment] = current
+            if current:
+                goal_time[current] += segment_durations[segment]
+    return segment_goalkeepers
+
+# Weight per segment a player is behind a minimum position quota, or beyond a maximum.
+# Quotas give way to playing in position (OUT_OF_POSITION_COST) but outweigh the
+# playtime and touchline costs of a single segment.
+QUOTA_COST = 10.0
+
+# Helper function to read a position quota field such as "mid 20-50, forward 10" into
+# {position: (minimum share, maximum share)} of the player's outfield minutes. A single
+# number is a minimum; "-30" is a maximum.
+def parse_quotas(text):
+    quotas = {}
+    for part in text.split(','):
+        words = part.split()
+        if not words:
+            continue
+        if len(words) != 2 or words[0] not in OUTFIELD_POSITIONS:
+            raise ValueError(f"Cannot read position quota: {part.strip()}")
+        low, _, high = words[1].rstrip('%').partition('-')
+        try:
+            quotas[words[0]] = (float(low or 0) / 100, float(high) / 100 if high else 1.0)
+        except ValueError:
+            raise ValueError(f"Cannot read position quota: {part.strip()}")
+    return quotas
+
+# Feasibility pre-check for position quotas, run once before planning so impossible
+# quotas are rejected up front. Each player's quotas must fit together, and for every
+# position the minimum segments owed there must fit in that position's slots, taking
+# each player's expected outfield segments as an even share of the outfield slots in
+# the segments they are available for (and not in goal).
+def check_quotas(players_data, segment_formations, segment_available, segment_goalkeepers):
+    expected = {player['name']: 0.0 for player in players_data}
+    for formation, available, keeper in zip(segment_formations, segment_available, segment_goalkeepers):
+        outfield = available - {keeper}
+        for name in outfield:
+            expected[name] += min(1.0, len(formation['outfield_slots']) / len(outfield))
+
+    owed = dict.fromkeys(OUTFIELD_POSITIONS, 0.0)
+    for player in players_data:
+        name = player['name']
+        quotas = player.get('quotas') or {}
+        for position, (low, high) in quotas.items():
+            if position not in OUTFIELD_POSITIONS:
+                raise ValueError(f"Unknown quota position: {position}")
+            if not 0 <= low <= high <= 1:
+                raise ValueError(f"{name}'s {position} quota must run from a minimum to a maximum between 0 and 100%")
+            if low > 0 and position not in player['positions']:
+                raise PlanInfeasible('quotas', f"{name} has a {position} quota but does not play {position}")
+            owed[position] += low * expected[name]
+        if sum(low for low, _ in quotas.values()) > 1 + 1e-9:
+            raise PlanInfeasible('quotas', f"{name}'s minimum quotas add up to more than 100%")
+        playable = [position for position in OUTFIELD_POSITIONS if position in player['positions']]
+        if playable and sum(quotas.get(position, (0, 1))[1] for position in playable) < 1 - 1e-9:
+            raise PlanInfeasible('quotas', f"{name}'s maximum quotas add up to less than 100%")
+
+    for position in OUTFIELD_POSITIONS:
+        slots = sum(formation['counts'][position] for formation in segment_formations)
+        if owed[position] > slots + 1e-9:
+            raise PlanInfeasible('quotas', f"The {position} quotas need about {math.ceil(owed[position])} segments "
+                                           f"at {position} but the formation only has {slots}")
+
+# Fatigue model for players with a stamina (minutes they can play continuously before
+# tiring): load rises by the minutes played outfield and falls by FATIGUE_RECOVERY
+# minutes for each minute off the pitch, so segments count for their actual length.
+# Playing beyond stamina costs FATIGUE_COST per minute over, growing with how far over
+# the player is.
+FATIGUE_RECOVERY = 2
+FATIGUE_COST = 1.0
+
+# Helper function to work out the cost of playing a segment of `duration` minutes for a
+# player with `stamina` who already carries `load` minutes of fatigue
+def fatigue_penalty(stamina, load, duration):
+    over = max(0.0, load + duration - stamina)
+    return FATIGUE_COST * over * (1 + over / stamina)
+
+# Helper function to lay out a match timeline. `periods` is the number of equal periods
+# (2 for halves, 4 for quarters) or a list of period lengths in minutes. Substitutions
+# happen at every period break and either at the `sub_points` given (minutes into the
+# match) or every `sub_time` minutes, evenly spread within each period. Returns the
+# (start, end) and duration of every segment, the period it is in, the segments that
+# start a new period, and a table of time labels so each is formatted once.
+def build_timeline(minutes, sub_time, periods=1, sub_points=None):
+    if isinstance(periods, int) and periods < 1:
+        raise ValueError("A match needs at least one period")
+    lengths = [minutes / periods] * periods if isinstance(periods, int) else list(periods)
+    if not lengths or min(lengths) <= 0 or abs(sum(lengths) - minutes) > 1e-6:
+        raise ValueError(f"Periods must be positive and add up to the {format_time(minutes)} minute match")
+    period_starts = list(itertools.accumulate(lengths, initial=0))[:-1]
+
+    if sub_points is None:
+        points = []
+        for start, length in zip(period_starts, lengths):
+            count = max(1, int(length / sub_time + 1e-9))
+            points.extend(start + index * length / count for index in range(count))
+    else:
+        if any(not 0 < point < minutes for point in sub_points):
+            raise ValueError(f"Substitution points must fall inside the {format_time(minutes)} minute match")
+        points = sorted(set(period_starts) | set(sub_points))
+    bounds = list(zip(points, points[1:] + [minutes]))
+
+    segment_periods = [bisect.bisect_right(period_starts, start + 1e-9) - 1 for start, _ in bounds]
+    return {
+        'bounds': bounds,
+        'durations': [end - start for start, end in bounds],
+        'periods': segment_periods,
+        'breaks': {segment for segment in range(1, len(bounds)) if segment_periods[segment] != segment_periods[segment - 1]},
+        'labels': [f'{format_time(start)} - {format_time(end)} mins' for start, end in bounds],
+    }
+
+# Game plan generation function with goalie rotation. Segments come from the match
+# timeline (see build_timeline) and may differ in length; fairness is kept in minutes.
+def generate_game_plan(minutes, sub_time, game_type, players_data, mode='greedy', stats=None, formation=None,
+                       rules=None, goal_blocks='half', carry_over=None, state=None, pair_history=None,
+                       sub_rules=None, periods=1, sub_points=None):
+    if mode not in SCHEDULING_MODES:
+        raise ValueError(f"Unknown scheduling mode: {mode}")
+    rules = {rule: value for rule, value in (rules or {}).items() if value is not None}
+    for rule in rules:
+        if rule not in CONSTRAINT_RULES:
+            raise ValueError(f"Unknown rule: {rule}")
+    if sub_rules and sub_rules == SUB_PROFILES['rolling']:
+        sub_rules = None
+    if sub_rules and rules:
+        raise ValueError("Plan with either playing-time rules or substitution rules, not both")
+    for player in players_data:
+        if player.get('stamina') is not None and not player['stamina'] > 0:
+            raise ValueError(f"{player['name']}'s stamina must be more than 0 minutes")
+
+    # Determine the formation for each period from the registry
+    formations = resolve_formations(game_type, formation)
+
+    # Lay out the segments from the match timeline
+    timeline = build_timeline(minutes, sub_time, periods, sub_points)
+    segment_bounds = timeline['bounds']
+    segment_durations = timeline['durations']
+    num_segments = len(segment_bounds)
+
+    # Formation for each segment: the shapes split the match evenly by time (e.g. one per half)
+    segment_formations = [formations[min(len(formations) - 1, int(start * len(formations) / minutes + 1e-9))]
+                          for start, _ in segment_bounds]
+
+    # Who is available in each segment
+    segment_available = index_availability(players_data, segment_bounds, minutes)
+
+    # Minutes outfield, on the bench, in goal and available, plus segment counts for the summary
+    playtime_tracker = {player['name']: 0 for player in players_data}
+    bench_minutes = {player['name']: 0 for player in players_data}
+    goal_minutes = {player['name']: 0 for player in players_data}
+    substitution_tracker = {player['name']: 0 for player in players_data}
+    goal_time_tracker = {player['name']: 0 for player in players_data}
+    absent_tracker = {player['name']: 0 for player in players_data}
+    available_tracker = {player['name']: 0 for player in players_data}
+    elapsed = 0
+    duration = segment_durations[0]  # length of the segment being planned
+
+    # Fairness state carried in from earlier matches on the same day (see generate_tournament_plan):
+    # minutes on the pitch and available, goal minutes, match time so far, and who finished on
+    if state is None:
+        state = {}
+    initial_state = copy.deepcopy(state) if stats is not None and mode != 'greedy' else None
+    prior_on_pitch = state.setdefault('on_pitch', {})
+    prior_available = state.setdefault('available', {})
+    prior_elapsed = state.setdefault('elapsed', 0)
+
+    # Fairness counts goal time as time on the pitch, measured against the time each player
+    # has been available so far and scaled to the time played so far, so it matches plain
+    # playtime for players there throughout. Goal time still to come in this match counts
+    # from the start, since the keepers are planned up front, so a later keeper is not also
+    # picked outfield before their block.
+    def fair_playtime(name):
+        on_pitch = prior_on_pitch.get(name, 0) + playtime_tracker[name] + goal_minutes[name]
+        available = prior_available.get(name, 0) + available_tracker[name]
+        return (on_pitch * (prior_elapsed + elapsed) / available if available else 0) + goal_ahead[name]
+
+    # Season carry-over breaks ties in favour of players who have had less of the pitch in
+    # earlier matches; players with no history count as average
+    carry_over = carry_over or {}
+    season_average = sum(carry_over.values()) / len(carry_over) if carry_over else 0
+    season_share = {player['name']: carry_over.get(player['name'], season_average) for player in players_data}
+
+    # Player ratings for balanced mode; unrated players count as the squad average
+    rated = [player['rating'] for player in players_data if player.get('rating') is not None]
+    average_rating = sum(rated) / len(rated) if rated else 0
+    ratings = {player['name']: average_rating if player.get('rating') is None else player['rating']
+               for player in players_data}
+    segment_strength = [0, 0]  # running strength and filled places of the segment being planned
+
+    # Partnership co-occurrence: segments each pair of players has shared the pitch, as a
+    # flat n x n array seeded from earlier matches and updated as each segment is fixed.
+    # pair_load holds each player's overlap with everyone already on in this segment.
+    num_players = len(players_data)
+    player_index = {player['name']: index for index, player in enumerate(players_data)}
+    pair_counts = [0.0] * (num_players * num_players)
+    for (first, second), count in (pair_history or {}).items():
+        if first in player_index and second in player_index:
+            pair_counts[player_index[first] * num_players + player_index[second]] += PAIR_HISTORY_WEIGHT * count
+            pair_counts[player_index[second] * num_players + player_index[first]] += PAIR_HISTORY_WEIGHT * count
+    pair_load = [0.0] * num_players
+
+    def add_to_segment(name):
+        segment_strength[0] += ratings[name]
+        segment_strength[1] += 1
+        row = player_index[name] * num_players
+        for other in range(num_players):
+            pair_load[other] += pair_counts[row + other]
+
+    game_plan = []
+
+    # Goalkeeper for each segment, planned up front in contiguous blocks
+    segment_goalkeepers = plan_goalkeepers(players_data, segment_available, segment_durations, goal_blocks,
+                                           state.setdefault('goal', {}))
+    goal_ahead = {player['name']: 0 for player in players_data}
+    for goalkeeper, segment_duration in zip(segment_goalkeepers, segment_durations):
+        if goalkeeper:
+            goal_ahead[goalkeeper] += segment_duration
+
+    # Position quotas: each player's {position: (minimum, maximum)} share of their outfield
+    # segments, checked up front, with segments per position counted as each segment is fixed
+    quotas = {player['name']: player.get('quotas') or {} for player in players_data}
+    has_quotas = any(quotas.values())
+    if has_quotas:
+        check_quotas(players_data, segment_formations, segment_available, segment_goalkeepers)
+    position_segments = {player['name']: dict.fromkeys(OUTFIELD_POSITIONS + ('total',), 0) for player in players_data}
+    player_positions = {player['name']: player['positions'] for player in players_data}
+
+    # Cost of one more segment at a position against the player's quotas: how many
+    # segments they would then be behind a minimum or beyond a maximum
+    def quota_cost(name, position):
+        played = position_segments[name]
+        total = played['total'] + 1
+        cost = 0.0
+        for quota_position, (low, high) in quotas[name].items():
+            count = played[quota_position] + (quota_position == position)
+            cost += max(0.0, low * total - count) + max(0.0, count - high * total)
+        return QUOTA_COST * cost
+
+    # Stamina of the players who have one, and everyone's fatigue load in minutes
+    staminas = {player['name']: player['stamina'] for player in players_data if player.get('stamina')}
+    fatigue_load = {player['name']: 0.0 for player in players_data}
+    stint_tracker = {player['name']: 0 for player in players_data}
+    longest_stint = 0
+    fatigue_incurred = 0.0
+
+    # Cost of playing the current segment, for a player with a stamina
+    def fatigue_cost(name):
+        stamina = staminas.get(name)
+        return fatigue_penalty(stamina, fatigue_load[name], duration) if stamina else 0.0
+
+    # With rules to meet, the constraint layer decides who is on the pitch in every segment
+    lineups = None
+    if rules:
+        lineups = solve_lineups(players_data, segment_formations, segment_goalkeepers, segment_durations, rules, stats,
+                                segment_available, season_share)
+
+    # With substitution rules to keep to, the substitution search decides instead
+    if sub_rules:
+        lineups = solve_sub_rules(players_data, segment_formations, segment_goalkeepers, segment_available,
+                                  segment_durations, sub_rules, stats, free_windows=timeline['breaks'])
+
+    def prioritize_by_playtime(players, position, assigned_players):
+        return sorted(
+            [player for player in players if position in player['positions'] and player['name'] not in assigned_players],
+            key=lambda p: (fair_playtime(p['name']) + fatigue_cost(p['name']), season_share[p['name']], len(p['positions']))
+        )
+
+    # Greedy outfield assignment: fill each position based on playtime, ensuring fair rotation
+    def assign_greedy_segment(segment_plan, assigned_players, formation, players):
+        for position in OUTFIELD_POSITIONS:
+            # Prioritize players with less playtime for each position
+            needed = formation['counts'][position]
+            preferred_players = prioritize_by_playtime(players, position, assigned_players)
+            if mode in ('balanced', 'diverse'):
+                preferred_players = pick_from_band(preferred_players, needed, formation)
+            for player in preferred_players[:needed]:
+                segment_plan['positions'][position].append(player['name'])
+                assigned_players.add(player['name'])
+                playtime_tracker[player['name']] += duration
+                add_to_segment(player['name'])
+
+        # If any slots remain, fill them out of position with the players who have played least
+        remaining_players = sorted(
+            [p for p in players if p['name'] not in assigned_players],
+            key=lambda p: (fair_playtime(p['name']) + fatigue_cost(p['name']), season_share[p['name']])
+        )
+        for position in OUTFIELD_POSITIONS:
+            while remaining_players and len(segment_plan['positions'][position]) < formation['counts'][position]:
+                player = remaining_players.pop(0)
+                segment_plan['positions'][position].append(player['name'])
+                assigned_players.add(player['name'])
+                playtime_tracker[player['name']] += duration
+
+    # Quota placement: keep the players chosen for the segment but reassign their outfield
+    # positions with one min-cost assignment, so quota positions are played where possible.
+    # Moving a player from the position they were picked for costs a tie-breaking fraction.
+    def place_by_quota(segment_plan, formation):
+        picked = [(name, position) for position in OUTFIELD_POSITIONS for name in segment_plan['positions'][position]]
+        slots = list(formation['outfield_slots'])
+        cost = [
+            [(OUT_OF_POSITION_COST if role not in player_positions[name] else 0.0) + quota_cost(name, role)
+             + (0.0 if role == position else 1e-3) for role in slots]
+            for name, position in picked
+        ]
+        for position in OUTFIELD_POSITIONS:
+            segment_plan['positions'][position] = []
+        for (name, _), column in zip(picked, min_cost_assignment(cost)):
+            segment_plan['positions'][slots[column]].append(name)
+
+    # Balanced and diverse modes: fill slots one at a time from the players level on
+    # playtime. Balanced takes whoever leaves the rest of the segment closest to the
+    # match-average strength; diverse takes whoever has shared the pitch least with the
+    # players already on. Strength, filled places and pair load are running totals.
+    def pick_from_band(preferred_players, needed, formation):
+        chosen = []
+        remaining = list(preferred_players)
+        strength, filled = segment_strength
+        while remaining and len(chosen) < needed:
+            level = (fair_playtime(remaining[0]['name']) + fatigue_cost(remaining[0]['name'])
+                     + BALANCE_PLAYTIME_SLACK * duration)
+            band = [p for p in remaining if fair_playtime(p['name']) + fatigue_cost(p['name']) <= level]
+            if mode == 'balanced':
+                ideal = average_rating * formation['players'] - strength - (formation['players'] - filled - 1) * average_rating
+                player = min(band, key=lambda p: abs(ratings[p['name']] - ideal))
+            else:
+                def overlap(p):
+                    row = player_index[p['name']] * num_players
+                    return pair_load[player_index[p['name']]] + sum(pair_counts[row + player_index[c['name']]]
+                                                                    for c in chosen)
+                player = min(band, key=overlap)
+            chosen.append(player)
+            remaining.remove(player)
+            strength += ratings[player['name']]
+            filled += 1
+        return chosen
+
+    # Sticky outfield assignment: fill the formation's slots and the bench with one
+    # min-cost assignment per stoppage
+    previous_roles = {}
+
+    def assign_sticky_segment(segment_plan, assigned_players, formation, candidates, change_costs=True):
+        slots = list(formation['outfield_slots'])
+        columns = slots + ['subs'] * max(0, len(candidates) - len(slots))
+        cost = []
+        for player in candidates:
+            name = player['name']
+            previous = previous_roles.get(name)
+            row = []
+            for role in columns:
+                if role == 'subs':
+                    # Coming off the pitch costs a substitution
+                    row.append(STICKY_SUB_COST * duration if change_costs and previous not in (None, 'subs') else 0.0)
+                    continue
+                value = (fair_playtime(name) + fatigue_cost(name) + season_share[name] * 1e-2
+                         + len(player['positions']) * 1e-3)
+                if role not in player['positions']:
+                    value += OUT_OF_POSITION_COST
+                if quotas[name]:
+                    value += quota_cost(name, role)
+                if change_costs and previous == 'subs':
+                    value += STICKY_SUB_COST * duration
+                elif change_costs and previous not in (None, 'goal', role):
+                    value += STICKY_POSITION_COST * duration
+                row.append(value)
+            cost.append(row)
+
+        for player, column in zip(candidates, min_cost_assignment(cost)):
+            role = columns[column]
+            if role == 'subs':
+                continue
+            segment_plan['positions'][role].append(player['name'])
+            assigned_players.add(player['name'])
+            playtime_tracker[player['name']] += duration
+
+    for segment in range(num_segments):
+        duration = segment_durations[segment]
+        segment_plan = {
+            'time': timeline['labels'][segment],
+            'positions': {
+                'goal': None,
+                'defense': [],
+                'mid': [],
+                'forward': []
+            },
+            'subs': [],
+            'unavailable': []
+        }
+
+        # Players outside their availability window sit this segment out entirely
+        present_players = []
+        elapsed += duration
+        for player in players_data:
+            if player['name'] in segment_available[segment]:
+                present_players.append(player)
+                available_tracker[player['name']] += duration
+            else:
+                segment_plan['unavailable'].append(player['name'])
+                absent_tracker[player['name']] += 1
+
+        assigned_players = set()
+
+        # Step 1: Assign the goalkeeper
+        segment_strength[:] = [0, 0]
+        pair_load[:] = [0.0] * num_players
+        current_goalkeeper = segment_goalkeepers[segment]
+        if current_goalkeeper:
+            segment_plan['positions']['goal'] = current_goalkeeper
+            assigned_players.add(current_goalkeeper)
+            goal_time_tracker[current_goalkeeper] += 1
+            goal_minutes[current_goalkeeper] += duration
+            goal_ahead[current_goalkeeper] -= duration
+            add_to_segment(current_goalkeeper)
+
+        # Step 2: Assign outfield players, either greedily by playtime or, in sticky mode,
+        # trading playtime against the cost of changing anyone's role at this stoppage.
+        # When the constraint layer has fixed the lineup, only positions are left to choose.
+        # Changes at a period break are free.
+        if lineups is not None:
+            lineup = [p for p in players_data if p['name'] in lineups[segment]]
+            assign_sticky_segment(segment_plan, assigned_players, segment_formations[segment], lineup,
+                                  change_costs=(mode == 'sticky' and segment not in timeline['breaks']))
+        elif mode == 'sticky':
+            candidates = [p for p in present_players if p['name'] not in assigned_players]
+            assign_sticky_segment(segment_plan, assigned_players, segment_formations[segment], candidates,
+                                  change_costs=(segment not in timeline['breaks']))
+        else:
+            assign_greedy_segment(segment_plan, assigned_players, segment_formations[segment], present_players)
+            if has_quotas:
+                place_by_quota(segment_plan, segment_formations[segment])
+
+        # Step 4: Assign remaining players as substitutes if no field slots are left
+        players_not_assigned = [p for p in present_players if p['name'] not in assigned_players]
+        for player in players_not_assigned:
+            segment_plan['subs'].append(player['name'])
+            substitution_tracker[player['name']] += 1
+            bench_minutes[player['name']] += duration
+
+        game_plan.append(segment_plan)
+
+        # Fix this segment's partnerships into the co-occurrence matrix
+        on_pitch = [player_index[name] for name in segment_names(segment_plan)]
+        for first in on_pitch:
+            for second in on_pitch:
+                if first != second:
+                    pair_counts[first * num_players + second] += 1
+        previous_roles = {name: 'subs' for name in segment_plan['subs']}
+        if segment_plan['positions']['goal']:
+            previous_roles[segment_plan['positions']['goal']] = 'goal'
+        for position in OUTFIELD_POSITIONS:
+            for name in segment_plan['positions'][position]:
+                previous_roles[name] = position
+                position_segments[name][position] += 1
+                position_segments[name]['total'] += 1
+
+        # Outfield players tire, players off the pitch recover, and the keeper holds steady
+        for name in fatigue_load:
+            role = previous_roles.get(name)
+            if role in OUTFIELD_POSITIONS:
+                fatigue_incurred += fatigue_cost(name)
+                fatigue_load[name] += duration
+                stint_tracker[name] += duration
+                longest_stint = max(longest_stint, stint_tracker[name])
+            elif role != 'goal':
+                fatigue_load[name] = max(0.0, fatigue_load[name] - FATIGUE_RECOVERY * duration)
+                stint_tracker[name] = 0
+            else:
+                stint_tracker[name] = 0
+
+    # Generate summary of time spent in goal, on field, and as substitutes
+    summary = {
+        player['name']: {
+            'goal_segments': goal_time_tracker[player['name']],
+            'sub_segments': substitution_tracker[player['name']],
+            'unavailable_segments': absent_tracker[player['name']],
+            'field_segments': (num_segments - substitution_tracker[player['name']] - goal_time_tracker[player['name']]
+                               - absent_tracker[player['name']]),
+            'mins_goal': goal_minutes[player['name']],
+            'mins_field': playtime_tracker[player['name']],
+            'mins_off': bench_minutes[player['name']],
+            'mins_subbed_goal': bench_minutes[player['name']] + goal_minutes[player['name']]
+        } for player in players_data
+    }
+
+    # Hand the fairness state on to the next match
+    for name in playtime_tracker:
+        prior_on_pitch[name] = prior_on_pitch.get(name, 0) + playtime_tracker[name] + goal_minutes[name]
+        prior_available[name] = prior_available.get(name, 0) + available_tracker[name]
+    state['elapsed'] = prior_elapsed + elapsed
+    state['finished_on'] = {name for name, role in previous_roles.items() if role != 'subs'}
+
+    # Report touchline moves, and for sticky mode how many it saved over the greedy
+    if stats is not None:
+        stats['mode'] = mode
+        stats['touchline_moves'] = count_touchline_moves(game_plan)
+        if sub_rules:
+            stats['subs_used'], stats['windows_used'] = count_substitutions(game_plan, timeline['breaks'])
+        stats['longest_stint'] = format_time(longest_stint)
+        if staminas:
+            stats['fatigue'] = round(fatigue_incurred, 1)
+        pairings = count_pairings(game_plan)
+        stats['distinct_pairs'] = len(pairings)
+        stats['most_shared_segments'] = max(pairings.values(), default=0)
+        if has_quotas:
+            # Quotas count as met to the nearest whole segment
+            stats['quota_misses'] = [
+                f"{name} at {position}" for name, player_quotas in quotas.items()
+                for position, (low, high) in player_quotas.items()
+                if not (math.floor(low * position_segments[name]['total'] + 1e-9)
+                        <= position_segments[name][position]
+                        <= math.ceil(high * position_segments[name]['total'] - 1e-9))
+            ]
+        if rated:
+            strengths = [sum(ratings[name] for name in segment_names(segment_plan)) for segment_plan in game_plan]
+            stats['strength_target'] = average_rating * segment_formations[0]['players']
+            stats['strength_range'] = (min(strengths), max(strengths))
+        if mode != 'greedy':
+            baseline_plan, _ = generate_game_plan(minutes, sub_time, game_type, players_data, formation=formation,
+                                                  rules=rules, goal_blocks=goal_blocks, carry_over=carry_over,
+                                                  state=initial_state, pair_history=pair_history, sub_rules=sub_rules,
+                                                  periods=periods, sub_points=sub_points)
+            stats['baseline_touchline_moves'] = count_touchline_moves(baseline_plan)
+            stats['touchline_moves_saved'] = stats['baseline_touchline_moves'] - stats['touchline_moves']
+
+    return game_plan, summary
+
+# Sport profiles for line-change sports. Each unit is a set of positions that changes
+# together as a line (hockey changes forward lines and defence pairs separately);
+# `shift` is the usual minutes per shift, `periods` the match periods, and `keeper`
+# whether a goalkeeper plays.
+SPORT_PROFILES = {
+    'futsal': {'keeper': True, 'shift': 2, 'periods': 2, 'units': [{'defense': 1, 'mid': 2, 'forward': 1}]},
+    'hockey': {'keeper': True, 'shift': 1, 'periods': 3, 'units': [{'forward': 3}, {'defense': 2}]},
+    'basketball': {'keeper': False, 'shift': 3, 'periods': 4, 'units': [{'guard': 2, 'forward': 2, 'center': 1}]},
+}
+
+# Display names for every position a plan can use
+POSITION_LABELS = {'goal': 'Goal', 'defense': 'Defense', 'mid': 'Midfield', 'forward': 'Forward', 'guard': 'Guard',
+                   'center': 'Center'}
+
+# Helper function to build the lines for a line-change sport. Outfield players go to the
+# unit they can play that is least covered so far (least flexible players first, anyone
+# who plays none of a unit's positions counting as able to play all of them), then each
+# unit's players are dealt into as many full lines as they make, snake order by rating
+# so lines come out even. Returns one list of lines (lists of names) per unit.
+def build_lines(players, units):
+    unit_positions = [set(unit) for unit in units]
+    unit_sizes = [sum(unit.values()) for unit in units]
+
+    def playable(player):
+        fits = [index for index, positions in enumerate(unit_positions) if positions & set(player['positions'])]
+        return fits or list(range(len(units)))
+
+    pools = [[] for _ in units]
+    for player in sorted(players, key=lambda p: len(playable(p))):
+        unit = min(playable(player), key=lambda index: (len(pools[index]) / unit_sizes[index], index))
+        pools[unit].append(player)
+
+    unit_lines = []
+    for pool, size in zip(pools, unit_sizes):
+        if len(pool) < size:
+            raise ValueError(f"Not enough players to make a line of {size}")
+        num_lines = len(pool) // size
+        ranked = sorted(pool, key=lambda p: -(p.get('rating') or 0))
+        lines = [[] for _ in range(num_lines)]
+        for index, player in enumerate(ranked):
+            lap, seat = divmod(index, num_lines)
+            lines[seat if lap % 2 == 0 else num_lines - 1 - seat].append(player['name'])
+        unit_lines.append(lines)
+    return unit_lines
+
+# Line-change planner for futsal, hockey and basketball. Lines are the unit of rotation:
+# at every change each unit sends on the line whose players have had the least time
+# (a line with spare players sends its members on in turn), so a game costs a fixed
+# amount of work per segment however many segments it has. Positions within a line are
+# assigned once per lineup and reused. Players missing from a line (outside their
+# availability) are covered by whoever available has played least.
+def generate_line_plan(minutes, shift, sport, players_data, goal_blocks='match', stats=None):
+    if sport not in SPORT_PROFILES:
+        raise ValueError(f"Unknown sport: {sport}")
+    profile = SPORT_PROFILES[sport]
+    timeline = build_timeline(minutes, shift or profile['shift'], profile['periods'])
+    segment_durations = timeline['durations']
+    num_segments = len(segment_durations)
+    segment_available = index_availability(players_data, timeline['bounds'], minutes)
+    by_name = {player['name']: player for player in players_data}
+
+    # Keepers, planned up front in blocks; everyone else who plays outside goal skates
+    segment_goalkeepers = [None] * num_segments
+    goal_time = {}
+    if profile['keeper']:
+        segment_goalkeepers = plan_goalkeepers(players_data, segment_available, segment_durations, goal_blocks,
+                                               goal_time)
+    keepers = set(segment_goalkeepers) - {None}
+    skaters = [player for player in players_data
+               if player['name'] not in keepers and (not profile['keeper'] or set(player['positions']) - {'goal'})]
+    unit_lines = build_lines(skaters, profile['units'])
+
+    line_minutes = [[0.0] * len(lines) for lines in unit_lines]
+    line_shifts = [[0] * len(lines) for lines in unit_lines]
+    on_minutes = {player['name']: 0.0 for player in players_data}
+    bench_minutes = {player['name']: 0.0 for player in players_data}
+    counts = {player['name']: {'goal': 0, 'field': 0, 'sub': 0, 'unavailable': 0} for player in players_data}
+    placements = {}  # positions for each lineup already seen, keyed by unit and names
+    line_changes = 0
+    previous_lines = None
+
+    def place(unit_index, names):
+        key = (unit_index, tuple(names))
+        if key not in placements:
+            slots = [position for position, count in profile['units'][unit_index].items() for _ in range(count)]
+            cost = [[0.0 if slot in by_name[name]['positions'] or not set(slots) & set(by_name[name]['positions'])
+                     else OUT_OF_POSITION_COST for slot in slots] for name in names]
+            placements[key] = [slots[column] for column in min_cost_assignment(cost)]
+        return zip(names, placements[key])
+
+    game_plan = []
+    for segment in range(num_segments):
+        duration = segment_durations[segment]
+        available = segment_available[segment]
+        keeper = segment_goalkeepers[segment]
+        positions = {'goal': keeper} if profile['keeper'] else {}
+        for unit in profile['units']:
+            for position in unit:
+                positions.setdefault(position, [])
+        segment_plan = {'time': timeline['labels'][segment], 'positions': positions, 'subs': [], 'unavailable': []}
+
+        on = {keeper} if keeper else set()
+        chosen_lines = []
+        for unit_index, lines in enumerate(unit_lines):
+            size = sum(profile['units'][unit_index].values())
+            # The line whose players have had least time per head goes on
+            line = min(range(len(lines)),
+                       key=lambda index: line_minutes[unit_index][index] * size / len(lines[index]))
+            members = lines[line]
+            offset = line_shifts[unit_index][line] * size % len(members)
+            rotation = members[offset:] + members[:offset]
+            names = [name for name in rotation if name in available and name not in on][:size]
+            if len(names) < size:
+                cover = sorted((name for name in available if name not in on and name not in names
+                                and name not in keepers), key=lambda name: on_minutes[name])
+                names += cover[:size - len(names)]
+            for name, position in place(unit_index, names):
+                positions[position].append(name)
+                on.add(name)
+            line_minutes[unit_index][line] += duration
+            line_shifts[unit_index][line] += 1
+            chosen_lines.append(line)
+        if previous_lines is not None:
+            line_changes += sum(line != before for line, before in zip(chosen_lines, previous_lines))
+        previous_lines = chosen_lines
+
+        for player in players_data:
+            name = player['name']
+            if name not in available:
+                segment_plan['unavailable'].append(name)
+                counts[name]['unavailable'] += 1
+            elif name == keeper:
+                counts[name]['goal'] += 1
+            elif name in on:
+                counts[name]['field'] += 1
+                on_minutes[name] += duration
+            else:
+                segment_plan['subs'].append(name)
+                counts[name]['sub'] += 1
+                bench_minutes[name] += duration
+        game_plan.append(segment_plan)
+
+    summary = {
+        name: {
+            'goal_segments': count['goal'],
+            'sub_segments': count['sub'],
+            'unavailable_segments': count['unavailable'],
+            'field_segments': count['field'],
+            'mins_goal': goal_time.get(name, 0),
+            'mins_field': on_minutes[name],
+            'mins_off': bench_minutes[name],
+            'mins_subbed_goal': bench_minutes[name] + goal_time.get(name, 0),
+        } for name, count in counts.items()
+    }
+    if stats is not None:
+        stats['sport'] = sport
+        stats['segments'] = num_segments
+        stats['lines'] = unit_lines
+        stats['line_changes'] = line_changes
+    return game_plan, summary
+
+# Tournament-day planner: plans a sequence of matches in order with one fairness state
+# shared between them, so minutes and goal time balance across the whole day. Each match
+# is a dict with minutes, game_type and optionally sub_time, formation, rules, sub_rules,
+# periods and sub_points (see build_timeline) and gap (the minutes between the previous
+# match ending and this one kicking off). Players who ended the previous match on the
+# pitch sit out the start of the next until they have had `min_rest` minutes off. Every
+# match carries on from the state the previous one left, so a day costs no more than
+# planning its matches one after another.
+def generate_tournament_plan(matches, players_data, mode='greedy', goal_blocks='half', min_rest=0, carry_over=None,
+                             stats=None):
+    state = {}
+    plans = []
+    pair_history = {}
+    for index, match in enumerate(matches):
+        minutes = match['minutes']
+        sub_time = match.get('sub_time') or calculate_sub_time(minutes, None, len(players_data), num_goalkeepers=1)
+
+        # Push back the availability of players still owed rest from the previous match,
+        # most minutes first, as long as that leaves enough players (and a keeper) to start
+        roster = players_data
+        rest_needed = min_rest - match.get('gap', 0)
+        if index and rest_needed > 0:
+            places = resolve_formations(match['game_type'], match.get('formation'))[0]['players']
+            resting = set()
+            for name in sorted(state['finished_on'], key=lambda name: -state['on_pitch'][name]):
+                if len(players_data) - len(resting) <= places:
+                    break
+                keepers_left = [p for p in players_data
+                                if 'goal' in p['positions'] and p['name'] not in resting and p['name'] != name]
+                if keepers_left or 'goal' not in next(p for p in players_data if p['name'] == name)['positions']:
+                    resting.add(name)
+            roster = []
+            for player in players_data:
+                if player['name'] in resting:
+                    start, end = availability_window(player, minutes)
+                    player = dict(player, available=(max(start, min(rest_needed, end - sub_time)), end))
+                roster.append(player)
+            if stats is not None:
+                stats['rested'] = stats.get('rested', 0) + len(resting)
+
+        plans.append(generate_game_plan(minutes, sub_time, match['game_type'], roster, mode=mode,
+                                        formation=match.get('formation'), rules=match.get('rules'),
+                                        sub_rules=match.get('sub_rules'), goal_blocks=goal_blocks,
+                                        carry_over=carry_over, state=state,
+                                        pair_history=pair_history, periods=match.get('periods', 1),
+                                        sub_points=match.get('sub_points')))
+        for pair, count in count_pairings(plans[-1][0]).items():
+            pair_history[pair] = pair_history.get(pair, 0) + count
+
+    # Day totals per player
+    day_summary = {
+        player['name']: {
+            'mins_on_pitch': state['on_pitch'][player['name']],
+            'mins_goal': state['goal'].get(player['name'], 0),
+            'mins_available': state['available'][player['name']],
+        } for player in players_data
+    }
+    if stats is not None:
+        stats['matches'] = len(plans)
+        stats['touchline_moves'] = sum(count_touchline_moves(game_plan) for game_plan, _ in plans)
+    return plans, day_summary
+
+# Penalty per position (or goalkeeper) a split leaves uncovered, and per missing player
+SPLIT_COVER_PENALTY = 1000.0
+
+# Helper function to score one game of a squad split: how far its players' expected
+# share of pitch time is from the squad-wide share, weighted by their available minutes,
+# plus penalties for positions nobody in the game can play and for being short of players
+def score_split_game(group, formation, minutes, target_share):
+    available = sum(window[1] - window[0] for window in (availability_window(p, minutes) for p in group))
+    score = 0.0
+    if available:
+        share = min(1.0, formation['players'] * minutes / available)
+        score += available * (share - target_share) ** 2
+    score += SPLIT_COVER_PENALTY * max(0, formation['players'] - len(group))
+    for position, needed in formation['counts'].items():
+        can_play = sum(1 for p in group if position in p['positions'])
+        score += SPLIT_COVER_PENALTY * max(0, needed - can_play)
+    return score
+
+# Squad splitter: partitions one roster across games played at the same time, one per
+# entry in `game_types`. Keepers are shared out first, then the players with the fewest
+# positions go where their positions are most needed, then single moves and pairwise
+# swaps between games run until no change improves the split. The score balances each
+# game's expected share of pitch time per player against the squad as a whole, so
+# everyone can expect similar minutes whichever game they are in. Returns one list of
+# players per game.
+def split_squad(players_data, game_types, minutes, formations=None):
+    formations = formations or [None] * len(game_types)
+    game_formations = [resolve_formations(game_type, formation)[0]
+                       for game_type, formation in zip(game_types, formations)]
+    total_available = sum(window[1] - window[0] for window in (availability_window(p, minutes) for p in players_data))
+    target_share = min(1.0, sum(f['players'] for f in game_formations) * minutes / total_available)
+    groups = [[] for _ in game_types]
+
+    def score(index):
+        return score_split_game(groups[index], game_formations[index], minutes, target_share)
+
+    # Keepers first (dedicated before flexible), each to the game with fewest keepers so far
+    keepers = sorted((p for p in players_data if 'goal' in p['positions']), key=lambda p: len(p['positions']))
+    for player in keepers:
+        index = min(range(len(groups)), key=lambda i: (sum('goal' in p['positions'] for p in groups[i]),
+                                                       len(groups[i]) / game_formations[i]['players']))
+        groups[index].append(player)
+
+    # Everyone else by scarcity, to whichever game their arrival improves most
+    others = sorted((p for p in players_data if 'goal' not in p['positions']), key=lambda p: len(p['positions']))
+    for player in others:
+        best, best_gain = 0, None
+        for index in range(len(groups)):
+            before = score(index)
+            groups[index].append(player)
+            gain = score(index) - before
+            groups[index].pop()
+            if best_gain is None or gain < best_gain:
+                best, best_gain = index, gain
+        groups[best].append(player)
+
+    # Local search: move or swap players between games while the total score drops
+    scores = [score(index) for index in range(len(groups))]
+    improved = True
+    while improved:
+        improved = False
+        for source, target in itertools.permutations(range(len(groups)), 2):
+            for player in list(groups[source]):
+                if player not in groups[source]:
+                    continue
+                groups[source].remove(player)
+                groups[target].append(player)
+                new_source, new_target = score(source), score(target)
+                if new_source + new_target < scores[source] + scores[target] - 1e-9:
+                    scores[source], scores[target] = new_source, new_target
+                    improved = True
+                    continue
+                groups[target].remove(player)
+                for other in list(groups[target]):
+                    groups[target].remove(other)
+                    groups[target].append(player)
+                    groups[source].append(other)
+                    new_source, new_target = score(source), score(target)
+                    if new_source + new_target < scores[source] + scores[target] - 1e-9:
+                        scores[source], scores[target] = new_source, new_target
+                        improved = True
+                        break
+                    groups[source].remove(other)
+                    groups[target].remove(player)
+                    groups[target].append(other)
+                else:
+                    groups[source].append(player)
+
+    # Keep roster order within each game
+    order = {player['name']: index for index, player in enumerate(players_data)}
+    return [sorted(group, key=lambda p: order[p['name']]) for group in groups]
+
+# Plans simultaneous games on several pitches: splits the squad, then schedules each game
+# on its own, with the same rules, substitution rules and timeline (periods and
+# sub_points, see build_timeline). Returns the groups and one (game_plan, summary) per game.
+def generate_split_plans(minutes, game_types, players_data, mode='greedy', formations=None, rules=None,
+                         goal_blocks='half', carry_over=None, min_sub_time_input=None, stats=None, sub_rules=None,
+                         periods=1, sub_points=None):
+    formations = formations or [None] * len(game_types)
+    groups = split_squad(players_data, game_types, minutes, formations)
+    plans = []
+    for game_type, formation, group in zip(game_types, formations, groups):
+        sub_time = calculate_sub_time(minutes, min_sub_time_input, len(group), num_goalkeepers=1)
+        plans.append(generate_game_plan(minutes, sub_time, game_type, group, mode=mode, formation=formation,
+                                        rules=rules, goal_blocks=goal_blocks, carry_over=carry_over,
+                                        sub_rules=sub_rules, periods=periods, sub_points=sub_points))
+    if stats is not None:
+        stats['games'] = len(plans)
+        stats['squad_sizes'] = [len(group) for group in groups]
+    return groups, plans
+
+# Settings for a fixture that leaves them out (bulk CLI and background jobs)
+FIXTURE_DEFAULTS = {'minutes': 40, 'game_type': '7_a_side', 'mode': 'greedy', 'sport': 'football',
+                    'goal_blocks': 'half'}
+
+# Function to plan one fixture, a dict of its settings and players as the bulk CLI reads
+# them. Players without a name or positions get the same defaults as on the form, and as
+# on the form a squad needs at least two players. Errors come back with the fixture rather
+# than stopping a run of many fixtures.
+def plan_fixture(fixture):
+    try:
+        players = [{**player, 'name': player.get('name') or f'Player {index}',
+                    'positions': player.get('positions') or ['defense', 'mid', 'forward', 'goal']}
+                   for index, player in enumerate(fixture['players'], start=1)]
+        if len(players) < 2:
+            raise ValueError('Plans need at least two players')
+        minutes = fixture['minutes']
+        sub_time = fixture.get('sub_time') or calculate_sub_time(minutes, None, len(players), num_goalkeepers=1)
+        stats = {}
+        if fixture.get('sport', 'football') != 'football':
+            game_plan, summary = generate_line_plan(minutes, fixture.get('sub_time'), fixture['sport'], players,
+                                                    goal_blocks=fixture['goal_blocks'], stats=stats)
+        else:
+            game_plan, summary = generate_game_plan(minutes, sub_time, fixture['game_type'], players,
+                                                    mode=fixture['mode'], stats=stats,
+                                                    formation=fixture.get('formation'), rules=fixture.get('rules'),
+                                                    goal_blocks=fixture['goal_blocks'])
+    except (KeyError, TypeError, ValueError) as error:
+        return {'fixture': fixture.get('fixture'), 'error': str(error) or repr(error)}
+    return {'fixture': fixture['fixture'], 'game_plan': game_plan, 'summary': summary, 'sub_time': sub_time,
+            'stats': stats}
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from planner import (SCHEDULING_MODES, SUB_PROFILES, PlanInfeasible, build_timeline, calculate_sub_time,
+                     generate_game_plan, plan_fixture)
+
+# Helper function to build a roster of `count` players who can play anywhere
+def make_roster(count):
+    return [{'name': f'P{index}', 'positions': ['defense', 'mid', 'forward', 'goal']} for index in range(count)]
+
+# Helper function to list every stint in a plan as (player, start minute, minutes on)
+def stints(game_plan, bounds):
+    found = []
+    current = {}
+    for segment, (start, end) in zip(game_plan, bounds):
+        on_pitch = {segment['positions']['goal']}
+        for position, players in segment['positions'].items():
+            if position != 'goal':
+                on_pitch.update(players)
+        for name in set(current) - on_pitch:
+            found.append((name, *current.pop(name)))
+        for name in on_pitch:
+            first, played = current.get(name, (start, 0))
+            current[name] = (first, played + end - start)
+    found.extend((name, first, played) for name, (first, played) in current.items())
+    return found
+
+def test_min_stint_holds_at_full_time():
+    game_plan, _ = generate_game_plan(40, 5, '7_a_side', make_roster(10), rules={'min_stint': 15})
+    short = [stint for stint in stints(game_plan, build_timeline(40, 5)['bounds']) if stint[2] < 15]
+    assert short == []
+
+def test_min_stint_holds_at_end_of_availability():
+    roster = make_roster(10)
+    roster[9]['available'] = (0, 25)
+    game_plan, _ = generate_game_plan(40, 5, '7_a_side', roster, rules={'min_stint': 15})
+    short = [stint for stint in stints(game_plan, build_timeline(40, 5)['bounds']) if stint[2] < 15]
+    assert short == []
+
+def test_min_stint_that_cannot_be_met_is_reported():
+    with pytest.raises(PlanInfeasible) as error:
+        generate_game_plan(40, 5, '7_a_side', make_roster(10), rules={'min_stint': 15, 'max_bench_streak': 1})
+    assert error.value.rule == 'min_stint'
+
+def test_min_minutes_counts_uneven_segments_in_minutes():
+    _, summary = generate_game_plan(40, 5, '7_a_side', make_roster(10), rules={'min_minutes': 20},
+                                    sub_points=[10, 11, 20, 30])
+    assert min(details['mins_field'] + details['mins_goal'] for details in summary.values()) >= 20
+
+def test_stamina_must_be_positive():
+    roster = make_roster(10)
+    roster[0]['stamina'] = -5
+    with pytest.raises(ValueError):
+        generate_game_plan(60, 10, '7_a_side', roster)
+
+def test_later_keeper_is_not_also_played_outfield_first():
+    sub_time = calculate_sub_time(60, None, 14, num_goalkeepers=1)
+    segment = max(build_timeline(60, sub_time)['durations'])
+    for mode in SCHEDULING_MODES:
+        _, summary = generate_game_plan(60, sub_time, '7_a_side', make_roster(14), mode=mode)
+        minutes = [details['mins_field'] + details['mins_goal'] for details in summary.values()]
+        assert max(minutes) - min(minutes) <= segment + 1e-6, mode
+
+@pytest.mark.parametrize('count, min_minutes', [(14, 28), (14, 30), (12, 35)])
+def test_min_minutes_counts_planned_goal_time(count, min_minutes):
+    started = time.perf_counter()
+    _, summary = generate_game_plan(60, 5, '7_a_side', make_roster(count), rules={'min_minutes': min_minutes})
+    assert time.perf_counter() - started < 1.5
+    assert min(details['mins_field'] + details['mins_goal'] for details in summary.values()) >= min_minutes
+
+@pytest.mark.parametrize('profile', ['cup', 'league'])
+@pytest.mark.parametrize('count', [6, 7, 8])
+def test_players_do_not_come_back_on_without_re_entry(profile, count):
+    sub_time = calculate_sub_time(40, None, count, num_goalkeepers=1)
+    bounds = build_timeline(40, sub_time)['bounds']
+    game_plan, _ = generate_game_plan(40, sub_time, '5_a_side', make_roster(count), sub_rules=SUB_PROFILES[profile])
+    entered = [name for name, _, _ in stints(game_plan, bounds)]
+    assert len(entered) == len(set(entered))
+
+def test_fixture_with_one_player_is_reported():
+    result = plan_fixture({'fixture': 'Reds', 'minutes': 40, 'game_type': '7_a_side', 'mode': 'greedy',
+                           'goal_blocks': 'half', 'players': [{'name': 'Sam'}]})
+    assert result == {'fixture': 'Reds', 'error': 'Plans need at least two players'}
+
+def test_fatigue_counts_uneven_segments_in_minutes():
+    roster = make_roster(7)
+    roster[0].update(positions=['mid'], stamina=15)
+    stats = {}
+    generate_game_plan(40, 10, '7_a_side', roster, stats=stats, sub_points=[10, 30])
+    # On for 10, 20 and 10 minutes in a row: 15 minutes over in the second segment, 25 in the third
+    assert stats['fatigue'] == round(15 * (1 + 15 / 15) + 25 * (1 + 25 / 15), 1)